@@ -0,0 +1,4 @@
+"""
+benchmarks of the penv pipeline, run them as modules:
+python -m penv.bench.populate_bench --help
+"""
@@ -0,0 +1,106 @@
+"""
+synthetic LDAP DHCP data, shaped like the results of search_s:
+a list of (dn, {attribute: [bytes, ...]}) entries holding dhcpGroup,
+dhcpSubnet, dhcpPool and dhcpHost entries the way our labs lay them out.
+
+every subnet has one pool in the middle of its address range, hosts get
+static addresses in the rest of it. a share of the hosts has no address,
+and a few duplicate addresses / macs are thrown in for the sanity report.
+"""
+import random
+
+from ..netindex import int_to_ip
+
+BASE_NET = 10 << 24
+CONFIG_DN = 'cn=DHCP Config,%s'
+
+
+def _mac(n):
+    return '02:%02x:%02x:%02x:%02x:%02x' % (n >> 32 & 255, n >> 24 & 255, n >> 16 & 255, n >> 8 & 255, n & 255)
+
+
+def subnet_layout(prefix):
+    """
+    offsets (in a subnet of this prefix length) of the pool range and of
+    the addresses left for static hosts
+    """
+    size = 1 << (32 - prefix)
+    if size < 8:
+        raise ValueError('subnets of /%s are too small, use /29 or bigger' % prefix)
+    pool = (size // 4, size // 2 + size // 4 - 1)
+    # skip the network address, the router (1) and the broadcast address
+    static = [o for o in range(2, size - 1) if not pool[0] <= o <= pool[1]]
+    return pool, static
+
+
+def generate(hosts=1000, prefix=24, groups=None, noip_rate=0.05, dup_rate=0.001, seed=0,
+             basedn='dc=infinidat,dc=com', name_rate=0.001):
+    """
+    return the entries of a lab holding this many hosts.
+    groups - number of dhcpGroups the hosts are spread over (default one per 1000 hosts)
+    prefix - prefix length of the subnets, as many subnets as needed are made
+    noip_rate - share of hosts without a fixed-address
+    dup_rate - share of hosts reusing the address or mac of an earlier host
+    name_rate - share of hosts whose fixed-address is a hostname, not an address
+    """
+    return list(iter_generate(hosts, prefix, groups, noip_rate, dup_rate, seed, basedn, name_rate))
+
+
+def iter_generate(hosts=1000, prefix=24, groups=None, noip_rate=0.05, dup_rate=0.001, seed=0,
+                  basedn='dc=infinidat,dc=com', name_rate=0.001):
+    """
+    generator flavour of generate, the skeleton entries come first
+    """
+    rnd = random.Random(seed)
+    config = CONFIG_DN % basedn
+    groups = groups or hosts // 1000 + 1
+    pool, static = subnet_layout(prefix)
+    subnets = max(1, -(-hosts // len(static)))
+    size = 1 << (32 - prefix)
+
+    group_names = ['group%s' % g for g in range(groups)]
+    for name in group_names:
+        yield ('cn=%s,%s' % (name, config),
+               {'objectClass': [b'top', b'dhcpGroup'], 'cn': [name.encode()]})
+
+    for s in range(subnets):
+        first = BASE_NET + s * size
+        name = int_to_ip(first)
+        sdn = 'cn=%s,%s' % (name, config)
+        yield (sdn, {'objectClass': [b'top', b'dhcpSubnet', b'dhcpOptions'],
+                     'cn': [name.encode()],
+                     'dhcpNetMask': [str(prefix).encode()],
+                     'dhcpOption': [('routers %s' % int_to_ip(first + 1)).encode()],
+                     'dhcpStatements': [b'ddns-domainname "lab.infinidat.com"'],
+                     'dhcpComments': [('synthetic subnet %s' % s).encode()]})
+        pname = 'pool%s' % s
+        yield ('cn=%s,%s' % (pname, sdn),
+               {'objectClass': [b'top', b'dhcpPool', b'dhcpOptions'],
+                'cn': [pname.encode()],
+                'dhcpRange': [('%s %s' % (int_to_ip(first + pool[0]), int_to_ip(first + pool[1]))).encode()]})
+
+    for h in range(hosts):
+        hostname = 'host%s' % h
+        group = group_names[h % groups]
+        mac = _mac(h)
+        ip = BASE_NET + (h // len(static)) * size + static[h % len(static)]
+        if h and rnd.random() < dup_rate:
+            # reuse the mac or the address of an earlier host
+            other = rnd.randrange(h)
+            if rnd.random() < 0.5:
+                mac = _mac(other)
+            else:
+                ip = BASE_NET + (other // len(static)) * size + static[other % len(static)]
+        attrs = {'objectClass': [b'top', b'dhcpHost'],
+                 'cn': [hostname.encode()],
+                 'dhcpHWAddress': [('ethernet %s' % mac).encode()],
+                 'modifyTimestamp': [b'20260101000000Z']}
+        draw = rnd.random()
+        if draw < noip_rate:
+            pass
+        elif draw < noip_rate + name_rate:
+            # dhcpd resolves names given as fixed-address
+            attrs['dhcpStatements'] = [('fixed-address %s.lab.infinidat.com' % hostname).encode()]
+        else:
+            attrs['dhcpStatements'] = [('fixed-address %s' % int_to_ip(ip)).encode()]
+        yield ('cn=%s,cn=%s,%s' % (hostname, group, config), attrs)
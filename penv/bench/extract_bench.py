@@ -0,0 +1,170 @@
+"""
+timings of the LDAP extraction stages on synthetic data.
+
+a lab of --hosts hosts is generated (dataset.py) and served by a fake
+LDAP connection (fake_ldap.py), then every stage of an export runs on it:
+the paged pulls, extract_skeleton, the subnet index, process_raw,
+sanity_report and split_yml (with --parse-workers, process_raw once more
+on a process pool, checked to write the same bytes). wall time, cpu time and peak memory
+(tracemalloc, allocations made during the stage) are reported per stage
+as JSON. with --baseline, stages slower or bigger than the stored
+baseline by more than --tolerance are flagged and the exit code is 1.
+
+python -m penv.bench.extract_bench --hosts 100000 --save-baseline extract-baseline.json
+python -m penv.bench.extract_bench --hosts 100000 --baseline extract-baseline.json
+"""
+import os
+import gc
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+import click
+
+from .dataset import generate
+from .fake_ldap import fake_ldap
+from ..ldap import SKELETON_FILTER, SKELETON_ATTRS, HOSTS_FILTER, HOSTS_ATTRS
+
+# stages faster than this are not flagged, their timings are mostly noise
+MIN_SECONDS = 0.05
+
+
+def measure(func, trace_memory=True):
+    """
+    run func, return (its result, metrics of the run)
+    """
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = func()
+    metrics = {'wall': round(time.perf_counter() - wall, 4), 'cpu': round(time.process_time() - cpu, 4)}
+    if trace_memory:
+        metrics['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, metrics
+
+
+class Sink(object):
+    """
+    counts what is written to it
+    """
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text)
+
+
+def run(hosts, prefix, groups, page_size, shard_records, trace_memory=True, parse_workers=0):
+    """
+    run all stages, return the results as a dict
+    """
+    groups = groups or hosts // 1000 + 1
+    stages = dict()
+    tmpdir = tempfile.mkdtemp(prefix='penv-bench-')
+    try:
+        entries, stages['generate'] = measure(lambda: generate(hosts, prefix, groups), trace_memory)
+        ldaph = fake_ldap(entries, page_size=page_size)
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            skeleton, stages['pull_skeleton'] = measure(lambda: list(ldaph.pull_dhcp_data(SKELETON_FILTER, SKELETON_ATTRS)), trace_memory)
+            raw, stages['pull_hosts'] = measure(lambda: list(ldaph.pull_dhcp_data(HOSTS_FILTER, HOSTS_ATTRS)), trace_memory)
+            sink = Sink()
+            _, stages['extract_skeleton'] = measure(lambda: ldaph.extract_skeleton(rawdata=skeleton, out=sink), trace_memory)
+            stages['extract_skeleton']['bytes'] = sink.bytes
+            index, stages['subnet_index'] = measure(ldaph.subnet_index, trace_memory)
+
+            commands = os.path.join(tmpdir, 'commands.yml')
+
+            def process():
+                with open(commands, 'w') as f:
+                    ldaph.process_raw(data=raw, subnets=index, out=f)
+            _, stages['process_raw'] = measure(process, trace_memory)
+            stages['process_raw']['bytes'] = os.path.getsize(commands)
+            if parse_workers:
+                parallel = os.path.join(tmpdir, 'parallel.yml')
+
+                def process_parallel():
+                    with open(parallel, 'w') as f:
+                        ldaph.process_raw(data=raw, subnets=index, out=f, workers=parse_workers)
+                # tracemalloc doesn't see the workers, only the merging here
+                _, stages['process_raw_parallel'] = measure(process_parallel, trace_memory)
+                with open(commands, 'rb') as a, open(parallel, 'rb') as b:
+                    stages['process_raw_parallel']['identical'] = a.read() == b.read()
+                os.remove(parallel)
+            _, stages['sanity_report'] = measure(lambda: ldaph.sanity_report(raw, skeleton), trace_memory)
+            _, stages['split_yml'] = measure(lambda: ldaph.split_yml(commands, shard_records), trace_memory)
+            stages['split_yml']['files'] = len([f for f in os.listdir(tmpdir) if f.startswith('ymlcmd')])
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        'config': {'hosts': hosts, 'prefix': prefix, 'groups': groups, 'page_size': page_size,
+                   'shard_records': shard_records, 'trace_memory': trace_memory, 'parse_workers': parse_workers},
+        'entries': len(entries),
+        'searches': ldaph.ldap.searches,
+        'stages': stages,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    list of the regressions of result against baseline
+    """
+    regressions = []
+    for name, metrics in sorted(result['stages'].items()):
+        base = baseline.get('stages', {}).get(name)
+        if not base:
+            continue
+        for key in ('wall', 'peak'):
+            if key not in metrics or key not in base:
+                continue
+            if key == 'wall' and metrics[key] < MIN_SECONDS:
+                continue
+            if metrics[key] > base[key] * (1 + tolerance):
+                regressions.append({'stage': name, 'metric': key, 'baseline': base[key], 'value': metrics[key],
+                                    'ratio': round(float(metrics[key]) / base[key], 2) if base[key] else None})
+    return regressions
+
+
+@click.command()
+@click.option('--hosts', default=10000, help='number of hosts in the synthetic lab (1000 to 1000000)')
+@click.option('--prefix', default=24, help='prefix length of the synthetic subnets')
+@click.option('--groups', default=0, help='number of groups (default one per 1000 hosts)')
+@click.option('--page-size', default=1000, help='LDAP entries per page (0 = no paging)')
+@click.option('--shard-records', default=500, help='records per file for split_yml')
+@click.option('--trace-memory/--no-trace-memory', default=True, help='record peak memory (slows every stage down)')
+@click.option('--baseline', default=None, help='JSON results of an earlier run to compare with')
+@click.option('--tolerance', default=0.2, help='allowed growth over the baseline (0.2 = 20%)')
+@click.option('--save-baseline', default=None, help='write the results to this file as the new baseline')
+@click.option('--parse-workers', default=0, help='also time process_raw on this many processes (-1 = one per core)')
+@click.pass_context
+def main(ctx, hosts, prefix, groups, page_size, shard_records, trace_memory, baseline, tolerance, save_baseline,
+         parse_workers):
+    result = run(hosts, prefix, groups or None, page_size, shard_records, trace_memory, parse_workers)
+    regressions = []
+    if baseline:
+        with open(baseline, 'r') as f:
+            base = json.load(f)
+        if base.get('config') != result['config']:
+            click.secho('Baseline was made with %s, timings may not compare' % base.get('config'), fg='yellow', err=True)
+        regressions = compare(result, base, tolerance)
+        result['regressions'] = regressions
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            f.write(text + "\n")
+    click.echo(text)
+    for r in regressions:
+        click.secho('REGRESSION %(stage)s %(metric)s: %(value)s vs %(baseline)s (x%(ratio)s)' % r, fg='red', err=True)
+    if regressions:
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    main()
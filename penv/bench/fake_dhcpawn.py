@@ -0,0 +1,127 @@
+"""
+local stand-in for a DHCPawn server, for benchmarking populate.
+accepts POSTs to /rest/multiple/, /rest/subnets/, /rest/pools/,
+/rest/dhcpranges/, /rest/calcranges/ and /rest/groups/, PUTs and DELETEs
+to /rest/<kind>/<key>/ (counted as "PUT /rest/<kind>/"...), with
+configurable latency and error injection. GETs of a collection answer
+an empty list, the server keeps nothing.
+"""
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ENDPOINTS = ('/rest/multiple/', '/rest/subnets/', '/rest/pools/', '/rest/dhcpranges/',
+             '/rest/calcranges/', '/rest/groups/', '/rest/hosts/')
+
+
+class FakeDHCPawn(ThreadingHTTPServer):
+    """
+    latency - seconds every request takes (plus up to `jitter` seconds)
+    error_rate - share of requests answered with a 503
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        ThreadingHTTPServer.__init__(self, (host, port), FakeDHCPawnHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.records = 0
+        self.errors = 0
+        self.by_url = dict()
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-dhcpawn')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'records': self.records,
+                    'errors': self.errors, 'by_url': dict(self.by_url)}
+
+
+class FakeDHCPawnHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, with Nagle on the body waits for
+    # the client's delayed ACK (~40ms) and the bench measures that instead
+    disable_nagle_algorithm = True
+
+    def _answer(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path not in ENDPOINTS:
+            self._answer(404, 'Not Found')
+            return
+        self._answer(200, '[]')
+
+    def do_PUT(self):
+        self.do_POST()
+
+    def do_DELETE(self):
+        self.do_POST()
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        path = self.path
+        if self.command != 'POST':
+            # /rest/<kind>/<key>/
+            path = '/'.join(path.split('/')[:3]) + '/'
+        if path not in ENDPOINTS:
+            self._answer(404, 'Not Found')
+            return
+        if self.command != 'POST':
+            path = '%s %s' % (self.command, path)
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            self._answer(400, 'Bad Request')
+            return
+
+        with server.lock:
+            delay = server.latency + server.random.random() * server.jitter
+            fail = server.random.random() < server.error_rate
+        if delay:
+            time.sleep(delay)
+
+        with server.lock:
+            server.requests += 1
+            if fail:
+                server.errors += 1
+            else:
+                if self.path == '/rest/multiple/':
+                    records = len([k for k in data if k != 'deploy'])
+                else:
+                    records = 1
+                server.records += records
+                server.by_url[path] = server.by_url.get(path, 0) + records
+        if fail:
+            self._answer(503, 'Service Unavailable (injected)')
+        else:
+            self._answer(200, 'OK')
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,166 @@
+"""
+in memory stand-in for a python-ldap LDAPObject, serving a list of
+(dn, attrs) entries (see dataset.py).
+filters are evaluated (&, |, !, equality, presence, substrings, >=, <=),
+attribute lists are honoured and the Simple Paged Results control is
+supported, so Ldap.pull_dhcp_data runs its real paged code path on it.
+"""
+import re
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+from ..ldap import Ldap
+
+_ESCAPED = re.compile(r'\\([0-9a-fA-F]{2})')
+
+
+def _unescape(value):
+    return _ESCAPED.sub(lambda m: chr(int(m.group(1), 16)), value)
+
+
+def _split(body):
+    """
+    split '(a)(b)(c)' into its parenthesized parts
+    """
+    parts = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(body):
+        if c == '(':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                parts.append(body[start:i + 1])
+    return parts
+
+
+def compile_filter(filterstr):
+    """
+    turn an LDAP filter string into a predicate on an attrs dict
+    """
+    f = filterstr.strip()
+    if not (f.startswith('(') and f.endswith(')')):
+        f = '(%s)' % f
+    body = f[1:-1]
+    if body[0] in '&|!':
+        subs = [compile_filter(p) for p in _split(body[1:])]
+        if body[0] == '&':
+            return lambda attrs: all(s(attrs) for s in subs)
+        if body[0] == '|':
+            return lambda attrs: any(s(attrs) for s in subs)
+        return lambda attrs: not subs[0](attrs)
+
+    for op in ('>=', '<='):
+        if op in body:
+            name, value = body.split(op, 1)
+            value = _unescape(value)
+            if op == '>=':
+                return lambda attrs: any(v.decode('utf-8') >= value for v in attrs.get(name, ()))
+            return lambda attrs: any(v.decode('utf-8') <= value for v in attrs.get(name, ()))
+
+    name, value = body.split('=', 1)
+    if value == '*':
+        return lambda attrs: name in attrs
+    if '*' in value:
+        pieces = [re.escape(_unescape(p)) for p in value.split('*')]
+        rx = re.compile('^' + '.*'.join(pieces) + '$', re.I | re.S)
+        return lambda attrs: any(rx.match(v.decode('utf-8')) for v in attrs.get(name, ()))
+    value = _unescape(value).lower()
+    return lambda attrs: any(v.decode('utf-8').lower() == value for v in attrs.get(name, ()))
+
+
+class FakeLDAPObject(object):
+    """
+    answers searches out of entries, keeps count of what was asked
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = 0
+        self.returned = 0
+        self._results = dict()
+        self._msgid = 0
+        self._filters = dict()
+        # result of the search being paged through, so later pages
+        # don't search again
+        self._paged = (None, None)
+
+    def set_option(self, option, value):
+        pass
+
+    def simple_bind_s(self, who='', cred=''):
+        pass
+
+    def unbind_s(self):
+        pass
+
+    def _in_scope(self, dn, base, scope):
+        if scope == ldap.SCOPE_BASE:
+            return dn == base
+        if not dn.endswith(base):
+            return False
+        if scope == ldap.SCOPE_ONELEVEL:
+            return dn.count(',') == base.count(',') + 1
+        return True
+
+    def _search(self, base, scope, filterstr, attrlist):
+        match = self._filters.get(filterstr)
+        if match is None:
+            match = self._filters[filterstr] = compile_filter(filterstr)
+        self.searches += 1
+        result = []
+        for dn, attrs in self.entries:
+            if not self._in_scope(dn, base, scope) or not match(attrs):
+                continue
+            if attrlist:
+                attrs = dict((k, v) for k, v in attrs.items() if k in attrlist)
+            result.append((dn, attrs))
+        self.returned += len(result)
+        return result
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self._search(base, scope, filterstr, attrlist)
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                   serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        self._msgid += 1
+        paging = [c for c in serverctrls or () if c.controlType == SimplePagedResultsControl.controlType]
+        if not paging:
+            self._results[self._msgid] = (self._search(base, scope, filterstr, attrlist), None)
+            return self._msgid
+        key = (base, scope, filterstr, tuple(attrlist or ()))
+        if not paging[0].cookie or self._paged[0] != key:
+            self._paged = (key, self._search(base, scope, filterstr, attrlist))
+        self._results[self._msgid] = (self._paged[1], paging[0])
+        return self._msgid
+
+    def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+        result, ctrl = self._results.pop(msgid)
+        if ctrl is None:
+            return ldap.RES_SEARCH_RESULT, result, msgid, []
+        # the cookie is the offset of the next page
+        offset = int(ctrl.cookie or 0)
+        end = offset + ctrl.size
+        cookie = str(end).encode() if end < len(result) else b''
+        return (ldap.RES_SEARCH_RESULT, result[offset:end], msgid,
+                [SimplePagedResultsControl(True, size=ctrl.size, cookie=cookie)])
+
+    def abandon(self, msgid):
+        self._results.pop(msgid, None)
+
+
+def fake_ldap(entries, lab='infi1', page_size=1000):
+    """
+    an Ldap handle connected to lab, searching entries instead of a server
+    """
+    ldaph = Ldap()
+    ldaph.lab = lab
+    ldaph.host = ldaph.labs[lab][0]
+    ldaph.basedn = ldaph.labs[lab][1]
+    ldaph.page_size = page_size
+    ldaph.ldap = FakeLDAPObject(entries)
+    return ldaph
@@ -0,0 +1,158 @@
+"""
+throughput of `dhcpawn populate` against a local DHCPawn stand-in.
+
+generates a synthetic skeleton and host shards, serves them to a
+FakeDHCPawn with the requested latency and error rate, runs the populate
+command on them and prints records/sec, request latency percentiles and
+error counts as JSON:
+
+python -m penv.bench.populate_bench --hosts 20000 --latency 0.005 --error-rate 0.01
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
+
+import click
+
+from .fake_dhcpawn import FakeDHCPawn
+from ..writer import ShardWriter, write_skeleton, SKELETON_SECTIONS
+from ..formats import FORMATS, EXTENSIONS
+from ..netindex import int_to_ip
+from ..dhcpawn import populate
+
+BASE_NET = (10 << 24)
+
+
+def generate(folder, hosts, subnets=16, groups=8, shard_records=500, fmt='yaml'):
+    """
+    write a skeleton (a /24 subnet with a pool in its middle for every
+    subnet) and host shards to folder, return the number of records
+    """
+    sections = dict((name, []) for name in SKELETON_SECTIONS)
+    for g in range(groups):
+        sections['groups'].append({'url': '/rest/groups/', 'data': {'name': 'group%s' % g, 'deployed': False}})
+    for s in range(subnets):
+        first = BASE_NET + (s << 8)
+        name = int_to_ip(first)
+        pool = 'pool%s' % s
+        sections['subnets'].append({'url': '/rest/subnets/', 'data': {
+            'name': name, 'netmask': '255.255.255.0', 'deployed': False,
+            'options': {'dhcpComments': ['bench'], 'dhcpStatements': ['ddns-domainname bench'],
+                        'dhcpOption': ['routers %s' % int_to_ip(first + 254)]}}})
+        sections['pools'].append({'url': '/rest/pools/', 'data': {'name': pool, 'subnet_name': name, 'deployed': False}})
+        sections['dhcpranges'].append({'url': '/rest/dhcpranges/', 'data': {
+            'min': int_to_ip(first + 100), 'max': int_to_ip(first + 199), 'pool_name': pool, 'deployed': False}})
+        for lo, hi in ((1, 99), (200, 254)):
+            sections['calcranges'].append({'url': '/rest/calcranges/', 'data': {
+                'subnet_name': name, 'min': int_to_ip(first + lo), 'max': int_to_ip(first + hi), 'deployed': False}})
+    with open(os.path.join(folder, 'skeleton' + EXTENSIONS[fmt]), 'w') as f:
+        write_skeleton(f, sections, fmt)
+
+    writer = ShardWriter(folder, records=shard_records, fmt=fmt)
+    writer.begin()
+    for h in range(hosts):
+        # static addresses outside the pools, 1..99 of every subnet
+        ip = BASE_NET + ((h // 99 % subnets) << 8) + 1 + h % 99
+        writer.host('bench%s' % h, '02:00:%02x:%02x:%02x:%02x' % (h >> 24 & 255, h >> 16 & 255, h >> 8 & 255, h & 255),
+                    'group%s' % (h % groups), int_to_ip(ip), int_to_ip(ip & ~255))
+    writer.end()
+    return hosts + sum(len(sections[name]) for name in SKELETON_SECTIONS)
+
+
+def percentile(values, pct):
+    """
+    nearest rank percentile of a sorted list
+    """
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def run(hosts, subnets, groups, shard_records, fmt, latency, jitter, error_rate, seed, workers, retries, backoff,
+        coalesce, batch_size, folder=None, quiet=True):
+    """
+    run one benchmark, return the results as a dict
+    """
+    tmpdir = None
+    if folder is None:
+        folder = tmpdir = tempfile.mkdtemp(prefix='penv-bench-')
+    server = FakeDHCPawn(latency=latency, jitter=jitter, error_rate=error_rate, seed=seed).start()
+    try:
+        records = generate(folder, hosts, subnets, groups, shard_records, fmt)
+        args = ['--host', '127.0.0.1', '--port', str(server.port), '--full', '--folder', folder,
+                '--filename', 'ymlcmd', '--format', fmt, '--workers', str(workers),
+                '--retries', str(retries), '--backoff', str(backoff), '--batch-size', str(batch_size),
+                '--coalesce' if coalesce else '--no-coalesce']
+        ctx = populate.make_context('populate', args)
+        start = time.time()
+        with ctx:
+            try:
+                if quiet:
+                    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull), redirect_stderr(devnull):
+                        populate.invoke(ctx)
+                else:
+                    populate.invoke(ctx)
+            except click.Abort:
+                # failures are counted below
+                pass
+        elapsed = time.time() - start
+        stats = ctx.meta.get('penv.populate', {})
+    finally:
+        server.stop()
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    served = server.stats()
+    latencies = sorted(stats.get('latencies', []))
+    return {
+        'config': {'hosts': hosts, 'subnets': subnets, 'groups': groups, 'shard_records': shard_records,
+                   'format': fmt, 'latency': latency, 'jitter': jitter, 'error_rate': error_rate,
+                   'workers': workers, 'retries': retries, 'coalesce': coalesce, 'batch_size': batch_size},
+        'records': records,
+        'records_stored': served['records'],
+        'elapsed': round(elapsed, 4),
+        'records_per_sec': round(served['records'] / elapsed, 1) if elapsed else None,
+        'requests': served['requests'],
+        'latency': dict(('p%s' % p, percentile(latencies, p)) for p in (50, 90, 99)),
+        'errors': {'injected': served['errors'], 'retried': stats.get('retried'),
+                   'failed': stats.get('failed')},
+    }
+
+
+@click.command()
+@click.option('--hosts', default=10000, help='number of host records')
+@click.option('--subnets', default=16, help='number of subnets (each with a pool) in the skeleton')
+@click.option('--groups', default=8, help='number of groups in the skeleton')
+@click.option('--shard-records', default=500, help='hosts per shard file')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='yaml', help='format of the generated files')
+@click.option('--latency', default=0.0, help='seconds the server takes per request')
+@click.option('--jitter', default=0.0, help='up to this many seconds added to every request')
+@click.option('--error-rate', default=0.0, help='share of requests answered with a 503')
+@click.option('--seed', default=0, help='seed of the injected latency and errors')
+@click.option('--workers', default=8, help='populate --workers')
+@click.option('--retries', default=3, help='populate --retries')
+@click.option('--backoff', default=0.01, help='populate --backoff')
+@click.option('--coalesce/--no-coalesce', default=True, help='populate --coalesce')
+@click.option('--batch-size', default=500, help='populate --batch-size')
+@click.option('--folder', default=None, help='generate the files here and keep them (default a temporary dir)')
+@click.option('--ojson', default=None, help='also write the results to this file')
+@click.option('--verbose/--quiet', default=False, help='show the output of populate')
+def main(hosts, subnets, groups, shard_records, fmt, latency, jitter, error_rate, seed, workers, retries, backoff,
+         coalesce, batch_size, folder, ojson, verbose):
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    result = run(hosts, subnets, groups, shard_records, fmt, latency, jitter, error_rate, seed, workers, retries,
+                 backoff, coalesce, batch_size, folder, quiet=not verbose)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if ojson:
+        with open(ojson, 'w') as f:
+            f.write(text + "\n")
+    click.echo(text)
+
+
+if __name__ == '__main__':
+    main()
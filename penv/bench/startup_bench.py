@@ -0,0 +1,97 @@
+"""
+startup cost of the p command.
+
+every case runs `python -X importtime -m penv.scripts.entry_point <args>`
+in a fresh interpreter --runs times and reports the median wall time,
+the import time of the penv modules and what they pulled in (the sum of
+the -X importtime self times, the interpreter's own startup imports
+left out) and the heavy modules that were imported. a case over
+--budget seconds of import time, or importing a module it must not,
+makes it exit with 1:
+
+python -m penv.bench.startup_bench --budget 0.15
+"""
+import sys
+import json
+import time
+import subprocess
+
+import click
+
+HEAVY = ('ldap', 'yaml', 'requests')
+
+# (args, heavy modules the command may import)
+CASES = [
+    (['--help'], ()),
+    (['tmux', '--help'], ()),
+    (['dhcpawn', 'populate', '--help'], ()),
+    (['dhcpldap', '--help'], ('ldap', 'yaml', 'requests')),
+]
+
+
+def parse_importtime(stderr):
+    """
+    (penv import time in seconds, top level names of the modules imported),
+    the imports done before penv.scripts (the interpreter's) are not counted
+    """
+    total = 0
+    names = set()
+    started = False
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        names.add(name.split('.')[0])
+        if name.startswith('penv'):
+            started = True
+        if started:
+            total += int(self_us)
+    return total / 1e6, names
+
+
+def run_case(args, runs):
+    walls = []
+    import_times = []
+    names = set()
+    for _ in range(runs):
+        wall = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'penv.scripts.entry_point'] + args,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        walls.append(time.perf_counter() - wall)
+        seconds, imported = parse_importtime(proc.stderr)
+        import_times.append(seconds)
+        names |= imported
+    walls.sort()
+    import_times.sort()
+    return {'command': ' '.join(['p'] + args),
+            'wall': round(walls[len(walls) // 2], 4),
+            'imports': round(import_times[len(import_times) // 2], 4),
+            'heavy': sorted(names.intersection(HEAVY))}
+
+
+@click.command()
+@click.option('--runs', default=5, help='runs of every command, the median is reported')
+@click.option('--budget', default=0.15, help='max seconds of penv import time of a command')
+@click.pass_context
+def main(ctx, runs, budget):
+    results = []
+    failures = []
+    for args, allowed in CASES:
+        result = run_case(args, runs)
+        results.append(result)
+        unexpected = sorted(set(result['heavy']) - set(allowed))
+        if unexpected:
+            failures.append('%s imports %s' % (result['command'], ', '.join(unexpected)))
+        # commands loading LDAP / yaml are what the budget keeps the others away from
+        if not allowed and result['imports'] > budget:
+            failures.append('%s takes %ss to import, over %ss' % (result['command'], result['imports'], budget))
+    click.echo(json.dumps({'budget': budget, 'runs': runs, 'commands': results}, indent=2))
+    for failure in failures:
+        click.secho('OVER BUDGET %s' % failure, fg='red', err=True)
+    if failures:
+        ctx.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import os
+import time
+import gzip
+import pickle
+import hashlib
+
+SNAPSHOT_VERSION = 1
+# entries are pickled in chunks, one chunk is what we hold in memory
+# while reading or writing a snapshot
+CHUNK_SIZE = 1000
+
+
+class SnapshotCache(object):
+    """
+    on disk cache of LDAP pull results.
+    every pull (lab, host, basedn, filter, attributes) gets its own
+    snapshot file: a gzip stream holding a pickled header followed by
+    pickled chunks of raw (dn, attrs) entries, so a snapshot can be read
+    and written as a stream.
+    """
+
+    def __init__(self, path=None, ttl=300):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache', 'penv', 'snapshots')
+        self.path = path
+        self.ttl = ttl
+
+    def key(self, lab, host, basedn, filterstr, attrlist):
+        return {
+            'lab': lab.lower(),
+            'host': host,
+            'basedn': basedn,
+            'filter': filterstr,
+            'attrs': sorted(attrlist) if attrlist else None,
+        }
+
+    def filename(self, key):
+        digest = hashlib.sha1(repr(sorted(key.items())).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.path, '%s-%s.snap' % (key['lab'], digest))
+
+    def header(self, fname):
+        """
+        return the snapshot header or None if there is no usable snapshot
+        """
+        try:
+            with gzip.open(fname, 'rb') as f:
+                header = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if header.get('version') != SNAPSHOT_VERSION:
+            return None
+        return header
+
+    def age(self, fname):
+        header = self.header(fname)
+        if header is None:
+            return None
+        return time.time() - header['created']
+
+    def is_fresh(self, fname):
+        age = self.age(fname)
+        return age is not None and age < self.ttl
+
+    def read(self, fname):
+        """
+        yield the entries stored in a snapshot
+        """
+        with gzip.open(fname, 'rb') as f:
+            pickle.load(f) # header
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    break
+                for e in chunk:
+                    yield e
+
+    def store(self, fname, key, entries):
+        """
+        pass entries through while writing them to a snapshot.
+        the snapshot only replaces the previous one once all entries
+        were consumed, a partial pull never ends up in the cache.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, mode=0o700)
+        tmpname = '%s.%s.tmp' % (fname, os.getpid())
+        done = False
+        fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as f:
+                header = dict(key, version=SNAPSHOT_VERSION, created=time.time())
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                chunk = []
+                for e in entries:
+                    chunk.append(e)
+                    if len(chunk) >= CHUNK_SIZE:
+                        pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                        chunk = []
+                    yield e
+                if chunk:
+                    pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpname, fname)
+            done = True
+        finally:
+            if not done and os.path.exists(tmpname):
+                os.remove(tmpname)
@@ -0,0 +1,89 @@
+"""
+bound LDAP connections shared by all the labs a command works on.
+a connection is opened and bound once per (server, binddn) and reused
+for every later lab / pull reaching the same server as the same user.
+searches on several servers are sent out asynchronously (search_ext)
+before waiting on any of the answers (result3), so they overlap.
+"""
+import threading
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+
+class ConnectionManager(object):
+
+    def __init__(self, debug=False):
+        # python-ldap / libldap tracing, very verbose
+        self.debug = debug
+        self.connections = dict()
+        self.lock = threading.Lock()
+        self.binds = 0
+
+    def _open(self, host, binddn, password):
+        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+        conn = ldap.initialize("ldap://" + host + ":389")
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        conn.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
+        conn.set_option(ldap.OPT_X_TLS, ldap.OPT_X_TLS_DEMAND)
+        conn.set_option(ldap.OPT_X_TLS_DEMAND, False)
+        if self.debug:
+            conn.set_option(ldap.OPT_DEBUG_LEVEL, 255)
+        conn.simple_bind_s(binddn, password)
+        return conn
+
+    def get(self, host, binddn, password):
+        """
+        bound connection to host as binddn, opened on first use.
+        bind errors (ldap.LDAPError) are raised, nothing is kept then
+        """
+        key = (host, binddn)
+        with self.lock:
+            conn = self.connections.get(key)
+            if conn is None:
+                conn = self._open(host, binddn, password)
+                self.binds += 1
+                self.connections[key] = conn
+            return conn
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections.values():
+                try:
+                    conn.unbind_s()
+                except ldap.LDAPError:
+                    pass
+            self.connections.clear()
+
+    def search_many(self, searches, page_size=0):
+        """
+        run searches ((key, connection, basedn, filterstr, attrlist) tuples)
+        side by side, return key -> list of entries.
+        every search has at most one request (page) out at a time, the next
+        page of a search is asked for as soon as the previous one is in.
+        referrals (entries without a dn) are dropped.
+        """
+        results = dict()
+        pending = []
+
+        def send(key, conn, basedn, filterstr, attrlist, ctrl):
+            serverctrls = [ctrl] if ctrl is not None else None
+            msgid = conn.search_ext(basedn, ldap.SCOPE_SUBTREE, filterstr, attrlist, serverctrls=serverctrls)
+            pending.append((key, conn, basedn, filterstr, attrlist, ctrl, msgid))
+
+        for key, conn, basedn, filterstr, attrlist in searches:
+            results[key] = []
+            ctrl = SimplePagedResultsControl(True, size=page_size, cookie='') if page_size else None
+            send(key, conn, basedn, filterstr, attrlist, ctrl)
+
+        while pending:
+            key, conn, basedn, filterstr, attrlist, ctrl, msgid = pending.pop(0)
+            rtype, rdata, rmsgid, serverctrls = conn.result3(msgid)
+            results[key].extend(e for e in rdata if e[0] is not None)
+            if ctrl is None:
+                continue
+            pctrls = [c for c in serverctrls if c.controlType == SimplePagedResultsControl.controlType]
+            if pctrls and pctrls[0].cookie:
+                ctrl.cookie = pctrls[0].cookie
+                send(key, conn, basedn, filterstr, attrlist, ctrl)
+        return results
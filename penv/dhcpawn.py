@@ -0,0 +1,256 @@
+"""
+dhcpawn commands, they work on the files ldap_to_yml wrote and never
+touch LDAP, so nothing of python-ldap is imported here. requests (populate.py)
+is only imported by the commands that talk to DHCPawn, when they run.
+"""
+import os
+import click
+from .profiling import profiled, add
+from .schedule import SkeletonScheduler, KNOWN_URLS
+from .formats import iter_commands, format_of, FORMATS, EXTENSIONS, MULTIPLE_URL
+from .diff import load_export, load_live, diff_states, write_diff, KINDS
+
+
+@click.group()
+def dhcpawn():
+    pass
+
+
+##### POPULATE LDAP INFO YML FILES TO DHCPAWN DB /  LDAP
+def populate_single_file(populator, filename, fmt='yaml', coalescer=None):
+    """
+    post all commands of a file through the populator.
+    skeleton commands go through a SkeletonScheduler, and all of them are
+    posted before any command that comes after them in the file.
+    coalescer - HostCoalescer the host records of /rest/multiple/
+    commands go to, instead of posting the commands as they are
+    """
+    if format_of(filename) != fmt:
+        return
+    if populator.journal and populator.journal.is_complete(filename):
+        click.secho('Skipping %s, already populated' % filename, fg='yellow')
+        return
+    click.secho('Populating from %s' % filename, fg='blue')
+    # commands are read one by one, not loaded up front
+    indexes = []
+    scheduler = SkeletonScheduler(populator)
+    for i, command in enumerate(iter_commands(filename, fmt)):
+        if command['url'] in KNOWN_URLS:
+            indexes.append(i)
+            if not populator.skip(filename, i):
+                scheduler.add(command, filename, i)
+            continue
+        if scheduler.commands:
+            # hosts (and whatever else follows) need the skeleton above them
+            scheduler.run()
+            scheduler = SkeletonScheduler(populator)
+        if coalescer and command['url'] == MULTIPLE_URL:
+            deploy = command['data'].get('deploy')
+            for key, record in command['data'].items():
+                if key == 'deploy':
+                    continue
+                indexes.append(key)
+                if not populator.skip(filename, key):
+                    coalescer.add(filename, key, record, deploy)
+            continue
+        indexes.append(i)
+        if not populator.skip(filename, i):
+            populator.submit(command, filename, i)
+    if populator.journal:
+        populator.journal.expect(filename, indexes)
+    scheduler.run()
+
+def populate_skeleton(populator, filename, fmt='yaml'):
+    """
+    post the skeleton, every entry as soon as what it depends on is there
+    """
+    if populator.journal and populator.journal.is_complete(filename):
+        click.secho('Skipping %s, already populated' % filename, fg='yellow')
+        return
+    click.secho('Populating skeleton from %s' % filename, fg='blue')
+    scheduler = SkeletonScheduler(populator)
+    indexes = []
+    for i, command in enumerate(iter_commands(filename, fmt)):
+        indexes.append(i)
+        # what was already posted is there for its dependents
+        if not populator.skip(filename, i):
+            scheduler.add(command, filename, i)
+    if populator.journal:
+        populator.journal.expect(filename, indexes)
+    scheduler.run()
+
+def populate_batch(populator, folder, filename, fmt='yaml', coalescer=None):
+    # when batch is used i assume filename is a string
+    # like ymlcmd with which i can find all relelvant yml
+    # files in folder. folder must be used when batch is used.
+    # the commands of all files are posted concurrently
+    for f in sorted(os.listdir(folder)):
+        if f.startswith(filename):
+            curfile = folder + "/" + f
+            populate_single_file(populator, curfile, fmt, coalescer)
+    if coalescer:
+        coalescer.flush_all()
+
+def populate_diff(populator, filename, fmt='yaml'):
+    """
+    post a diff file (see diff.py): skeleton creates / updates along their
+    dependencies, then the hosts, then the deletes one kind at a time,
+    what depends on a record before the record itself
+    """
+    if populator.journal and populator.journal.is_complete(filename):
+        click.secho('Skipping %s, already populated' % filename, fg='yellow')
+        return
+    click.secho('Populating changes from %s' % filename, fg='blue')
+    scheduler = SkeletonScheduler(populator)
+    hosts = []
+    deletes = []
+    indexes = []
+    for i, command in enumerate(iter_commands(filename, fmt)):
+        indexes.append(i)
+        if populator.skip(filename, i):
+            continue
+        if command.get('method') == 'DELETE':
+            deletes.append((i, command))
+        elif command['url'] == MULTIPLE_URL or command['url'].startswith('/rest/hosts/'):
+            hosts.append((i, command))
+        else:
+            scheduler.add(command, filename, i)
+    if populator.journal:
+        populator.journal.expect(filename, indexes)
+    scheduler.run()
+    for i, command in hosts:
+        populator.submit(command, filename, i)
+    kind = None
+    for i, command in deletes:
+        # /rest/<kind>/<key>/, a kind is only deleted once the previous one is gone
+        if command['url'].split('/')[2] != kind:
+            populator.drain()
+            kind = command['url'].split('/')[2]
+        populator.submit(command, filename, i)
+
+def make_diff(folder, fmt, against=None, fetch=None):
+    """
+    diff the export in folder against the export in the folder against, or
+    against what fetch (Populator.fetch) gets from DHCPawn.
+    write it to folder/diff.yml (.jsonl), return the file name
+    """
+    new = load_export(folder, fmt)
+    if against:
+        click.secho('Comparing %s to the previous export in %s' % (folder, against), fg='blue')
+        old = load_export(against, fmt)
+    else:
+        click.secho('Comparing %s to what DHCPawn holds' % folder, fg='blue')
+        old = load_live(fetch)
+    changes = diff_states(old, new)
+    filename = os.path.join(os.path.abspath(folder), 'diff' + EXTENSIONS[fmt])
+    commands = write_diff(filename, changes, fmt)
+    for kind, url in KINDS:
+        c = changes['counts'][kind]
+        click.secho('%-10s %6s new %6s changed %6s gone %6s unchanged' % (kind, c['create'], c['update'], c['delete'], c['same']))
+    for kind, count in sorted(old.unknown.items()):
+        click.secho('%s %s records of DHCPawn left out, they lack the fields of an export' % (count, kind), fg='yellow')
+    # DHCPawn has no url for a single range, these are for whoever runs the diff
+    for kind, key, change in changes['unposted']:
+        click.secho('%s %s %s, not in the diff, fix it by hand' % (kind, key, change), fg='yellow')
+    click.secho('%s commands for %s records, written to %s' % (commands, new.count(), filename), fg='blue')
+    return filename
+
+@dhcpawn.command()
+@click.option('--folder', required=True, help='folder of the new export')
+@click.option('--against', default=None, help='folder of the previous export')
+@click.option('--live/--no-live', default=False, help='compare with what DHCPawn holds instead of a previous export')
+@click.option("--host", help="Host running DHCPawn (with --live)", default="localhost")
+@click.option("--port", help="Port on host running DHCPawn (with --live)", default=8000)
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='yaml', help='format of the export, yaml (default) or jsonl')
+def diff(folder, against, live, host, port, fmt):
+    '''
+    write the create / update / delete commands turning the previous export
+    (or DHCPawn's contents) into the new one to diff.yml in folder,
+    post them with populate --diff
+    '''
+    if bool(against) == live:
+        click.secho("Give either --against or --live", fg='red')
+        raise click.Abort()
+    from .populate import Populator
+    populator = Populator(host, port) if live else None
+    try:
+        make_diff(folder, fmt, against, populator.fetch if populator else None)
+    finally:
+        if populator:
+            populator.close()
+
+@dhcpawn.command()
+@click.option("--host", help="Host running DHCPawn", default="localhost")
+@click.option("--port", help="Port on host running DHCPawn", default=8000)
+@click.option("--filename", default='ymlcmd', help="YAML file containing population calls, like sample_data.yml")
+@click.option('--batch/--no-batch', default=False, help='in case we have several yml files to populate')
+@click.option('--folder', help='if batch used ,give directory where all yml files exist')
+@click.option('--full/--no-full', default=False , help='populate skeleton and all LDAP entries')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='yaml',
+              help='format of the files to populate, yaml (default, every file loaded whole) or jsonl (read line by line)')
+@click.option('--workers', default=8, help='number of concurrent requests to DHCPawn')
+@click.option('--inflight', default=0, help='max commands queued or in flight (default 2 x workers)')
+@click.option('--retries', default=3, help='retries on connection errors and 5xx answers')
+@click.option('--backoff', default=0.5, help='seconds before the first retry, doubled on every retry')
+@click.option('--resume/--no-resume', default=False, help='skip what the journal of the previous run says is done')
+@click.option('--coalesce/--no-coalesce', default=True, help='regroup host records of all files into /rest/multiple/ requests of a tuned size '
+              '(hosts only, skeleton commands are still posted one per request)')
+@click.option('--batch-size', default=500, help='hosts per /rest/multiple/ request to start with')
+@click.option('--max-batch-size', default=5000, help='upper limit of hosts per request')
+@click.option('--target-latency', default=5.0, help='requests slower than this (seconds) shrink the batch size')
+@click.option('--diff/--no-diff', 'diff_only', default=False, help='post only the changes in folder/diff.yml (see dhcpawn diff)')
+@click.option('--against', default=None, help='with --full, post only what changed since the export in this folder')
+@click.option('--against-live/--no-against-live', default=False, help='with --full, post only what DHCPawn doesn\'t hold yet')
+@profiled('populate')
+def populate(host, port, filename, batch, folder, full, fmt, workers, inflight, retries, backoff, resume,
+             coalesce, batch_size, max_batch_size, target_latency, diff_only, against, against_live):
+
+    if batch and (not folder or not filename):
+        click.secho("When using batch , you must give folder and filename", fg='red')
+        raise click.Abort()
+    if (diff_only or against or against_live) and not folder:
+        click.secho("Diffs are made / read in a folder, give --folder", fg='red')
+        raise click.Abort()
+
+    from .populate import Populator, Journal, BatchSizer, HostCoalescer, JOURNAL_NAME
+
+    # the journal lives with the files it keeps track of
+    if batch or full or diff_only:
+        journal_dir = os.path.abspath(folder)
+    else:
+        journal_dir = os.path.dirname(os.path.abspath(filename))
+    journal = Journal(os.path.join(journal_dir, JOURNAL_NAME), resume)
+    populator = Populator(host, port, workers, inflight, retries, backoff, journal=journal)
+    coalescer = None
+    if coalesce:
+        sizer = BatchSizer(batch_size, min(batch_size, 10), max(batch_size, max_batch_size), target_latency)
+        coalescer = HostCoalescer(populator, sizer)
+    try:
+        if full and (against or against_live):
+            diff_file = make_diff(folder, fmt, against, populator.fetch if against_live else None)
+            populate_diff(populator, diff_file, fmt)
+        elif diff_only:
+            populate_diff(populator, os.path.join(os.path.abspath(folder), 'diff' + EXTENSIONS[fmt]), fmt)
+        elif full:
+            # hosts need the whole skeleton in place
+            populate_skeleton(populator, os.path.abspath(folder) + "/" + 'skeleton' + EXTENSIONS[fmt], fmt)
+            populate_batch(populator, folder, filename, fmt, coalescer)
+        elif batch:
+            click.secho("Populating to %s:%s" % (host,port), fg='yellow')
+            populate_batch(populator, folder, filename, fmt, coalescer)
+        else:
+            click.secho("Populating to %s:%s" % (host,port), fg='yellow')
+            populate_single_file(populator, filename, fmt, coalescer)
+            if coalescer:
+                coalescer.flush_all()
+    finally:
+        populator.close()
+    add(records=populator.sent)
+    # for whoever invoked the command (benchmarks) to look at
+    click.get_current_context().meta['penv.populate'] = populator.stats()
+    if coalescer:
+        click.secho("Last batch size %s hosts per request" % coalescer.sizer.current(), fg='yellow')
+
+    if populator.report():
+        click.secho("%s commands left, rerun with --resume to post only those" % journal.pending(), fg='red')
+        raise click.Abort()
@@ -0,0 +1,238 @@
+"""
+differences between two states of DHCPawn data, as the commands turning
+the old one into the new one.
+a state is read from an export folder (skeleton + host shards, as
+ldap_to_yml writes them) or fetched from a running DHCPawn, and held as
+kind -> key -> record:
+
+groups, subnets, pools - by name
+dhcpranges - by pool name
+calcranges - by subnet name and range
+hosts - by hostname, a host found under a new hostname with a mac that
+        an old, now gone, host had is a rename (an update of the old one)
+
+new records are created with the usual POST commands (hosts in
+/rest/multiple/ commands), changed ones are sent with PUT and gone ones
+with DELETE, both to <collection url><name>/. only groups, subnets, pools
+and hosts are known to DHCPawn by name, changed and gone dhcpranges and
+calcranges are only reported, whoever runs the diff fixes them by hand.
+a record changed when any of the fields of the new record differs from
+the old one (fields only the old one has, like ids DHCPawn adds, don't
+count).
+"""
+import os
+import json
+
+from .formats import iter_commands, format_of, yaml_load, yaml_dump, jsonl_dump, EXTENSIONS, MULTIPLE_URL
+
+# kind -> collection url, in the order they are created
+KINDS = (
+    ('groups', '/rest/groups/'),
+    ('subnets', '/rest/subnets/'),
+    ('pools', '/rest/pools/'),
+    ('dhcpranges', '/rest/dhcpranges/'),
+    ('calcranges', '/rest/calcranges/'),
+    ('hosts', '/rest/hosts/'),
+)
+URLS = dict(KINDS)
+KIND_OF = dict((url, kind) for kind, url in KINDS)
+# kinds with a <collection url><name>/ item url, updated and deleted there
+ITEM_KINDS = ('groups', 'subnets', 'pools', 'hosts')
+
+
+def record_key(kind, data):
+    if kind == 'dhcpranges':
+        return data['pool_name']
+    if kind == 'calcranges':
+        return '%s:%s-%s' % (data['subnet_name'], data['min'], data['max'])
+    if kind == 'hosts':
+        return data['hostname']
+    return data['name']
+
+
+def item_url(kind, key):
+    assert kind in ITEM_KINDS, kind
+    return '%s%s/' % (URLS[kind], key)
+
+
+class State(object):
+    """
+    records of a DHCPawn state, kind -> key -> record.
+    deploy - key -> deploy value of the /rest/multiple/ command a host came in
+    unknown - kind -> number of records load_live couldn't key
+    """
+
+    def __init__(self):
+        self.records = dict((kind, dict()) for kind, url in KINDS)
+        self.deploy = dict()
+        self.unknown = dict()
+
+    def add(self, kind, data, deploy=None):
+        key = record_key(kind, data)
+        self.records[kind][key] = data
+        if kind == 'hosts':
+            self.deploy[key] = deploy
+
+    def add_command(self, command):
+        url = command['url']
+        if url == MULTIPLE_URL:
+            deploy = command['data'].get('deploy')
+            for k, record in command['data'].items():
+                if k != 'deploy':
+                    self.add('hosts', record, deploy)
+        elif url in KIND_OF:
+            self.add(KIND_OF[url], command['data'])
+
+    def count(self):
+        return sum(len(records) for records in self.records.values())
+
+
+def export_files(folder, fmt=None):
+    """
+    the skeleton and host files of an export folder, the shards listed
+    in its manifest when there is one
+    """
+    names = os.listdir(folder)
+    if fmt is None:
+        fmt = 'jsonl' if 'skeleton' + EXTENSIONS['jsonl'] in names else 'yaml'
+    files = []
+    skeleton = 'skeleton' + EXTENSIONS[fmt]
+    if skeleton in names:
+        files.append(os.path.join(folder, skeleton))
+    manifest = os.path.join(folder, 'manifest.yml')
+    if os.path.exists(manifest):
+        with open(manifest, 'r') as f:
+            text = f.read()
+        try:
+            info = json.loads(text)
+        except ValueError:
+            # written as yaml by earlier versions
+            info = yaml_load(text) or {}
+        shards = [s['file'] for s in info.get('shards', [])]
+    else:
+        shards = sorted(n for n in names if n.startswith('ymlcmd') and format_of(n) == fmt)
+        shards += ['commands' + EXTENSIONS[fmt]] if 'commands' + EXTENSIONS[fmt] in names else []
+    files.extend(os.path.join(folder, s) for s in shards)
+    return files, fmt
+
+
+def load_export(folder, fmt=None):
+    """
+    State of an export folder
+    """
+    state = State()
+    files, fmt = export_files(folder, fmt)
+    for filename in files:
+        for command in iter_commands(filename, fmt):
+            state.add_command(command)
+    return state
+
+
+def load_live(fetch):
+    """
+    State of a running DHCPawn.
+    fetch - callable taking a collection url and returning its records
+    (the decoded JSON answer of a GET, a list of records or a dict of them).
+    the records are taken to hold the fields of the POSTs that made them,
+    those without the fields a record is keyed by are left out and counted
+    in State.unknown
+    """
+    state = State()
+    for kind, url in KINDS:
+        records = fetch(url)
+        if isinstance(records, dict):
+            records = list(records.values())
+        for data in records:
+            try:
+                state.add(kind, data)
+            except (KeyError, TypeError):
+                state.unknown[kind] = state.unknown.get(kind, 0) + 1
+    return state
+
+
+def changed(old, new):
+    return any(old.get(k) != v for k, v in new.items())
+
+
+def diff_states(old, new, batch=500):
+    """
+    commands turning old into new, as a dict of phase -> commands:
+    create - skeleton creates / updates and new or changed hosts
+    delete - deletes, hosts first and the skeleton from the bottom up
+    plus 'counts', kind -> {'create', 'update', 'delete', 'same'} and
+    'unposted', (kind, key, 'changed' or 'gone') of the changes of kinds
+    not in ITEM_KINDS, that have no command
+    """
+    create = []
+    delete = []
+    counts = dict()
+    unposted = []
+    for kind, url in KINDS:
+        olds = old.records[kind]
+        news = new.records[kind]
+        counts[kind] = c = {'create': 0, 'update': 0, 'delete': 0, 'same': 0}
+        gone = [key for key in olds if key not in news]
+        renamed = dict()
+        if kind == 'hosts':
+            # a mac moving to a new hostname is the same host renamed
+            gone_macs = dict((olds[key].get('mac'), key) for key in gone if olds[key].get('mac'))
+            for key, data in news.items():
+                if key not in olds and data.get('mac') in gone_macs:
+                    renamed[key] = gone_macs.pop(data['mac'])
+            gone = [key for key in gone if key not in set(renamed.values())]
+
+        hosts = []
+        for key in sorted(news):
+            data = news[key]
+            old_key = renamed.get(key, key)
+            if old_key not in olds:
+                c['create'] += 1
+                if kind == 'hosts':
+                    hosts.append((new.deploy.get(key), data))
+                else:
+                    create.append({'url': url, 'data': data})
+            elif old_key != key or changed(olds[old_key], data):
+                c['update'] += 1
+                if kind in ITEM_KINDS:
+                    create.append({'method': 'PUT', 'url': item_url(kind, old_key), 'data': data})
+                else:
+                    unposted.append((kind, key, 'changed'))
+            else:
+                c['same'] += 1
+        create.extend(multiple_commands(hosts, batch))
+
+        c['delete'] = len(gone)
+        if kind in ITEM_KINDS:
+            delete.append([{'method': 'DELETE', 'url': item_url(kind, key), 'data': {}} for key in sorted(gone)])
+        else:
+            unposted.extend((kind, key, 'gone') for key in sorted(gone))
+    # what depends on a record goes before it
+    return {'create': create, 'delete': [cmd for cmds in reversed(delete) for cmd in cmds], 'counts': counts,
+            'unposted': unposted}
+
+
+def multiple_commands(hosts, batch=500):
+    """
+    /rest/multiple/ commands of up to batch hosts for (deploy, record) pairs
+    """
+    commands = []
+    for deploy, record in hosts:
+        if not commands or commands[-1]['data'].get('deploy') != deploy or len(commands[-1]['data']) - 1 >= batch:
+            commands.append({'url': MULTIPLE_URL, 'data': {'deploy': deploy}})
+        data = commands[-1]['data']
+        data['h%s' % (len(data) - 1)] = record
+    return commands
+
+
+def write_diff(filename, changes, fmt='yaml'):
+    """
+    write the commands of diff_states to a command file, creates first
+    """
+    commands = changes['create'] + changes['delete']
+    with open(filename, 'w') as f:
+        if fmt == 'jsonl':
+            for command in commands:
+                f.write(jsonl_dump(command))
+        else:
+            yaml_dump(commands, f)
+    return len(commands)
@@ -0,0 +1,99 @@
+"""
+serialization formats of DHCPawn command files.
+yaml - a list of {'url':..., 'data':...} commands per file
+jsonl - JSON Lines, one command per line. host shards hold one
+/rest/multiple/ command per host, readers merge them back into
+bigger /rest/multiple/ commands.
+yaml uses the libyaml based C loader/dumper when pyyaml was built with it.
+pyyaml is imported the first time yaml is read or written, jsonl runs never load it.
+"""
+import json
+
+FORMATS = ('yaml', 'jsonl')
+EXTENSIONS = {'yaml': '.yml', 'jsonl': '.jsonl'}
+MULTIPLE_URL = '/rest/multiple/'
+
+_yaml = None
+
+
+def _yaml_module():
+    """
+    (yaml, loader, dumper)
+    """
+    global _yaml
+    if _yaml is None:
+        import yaml
+        _yaml = (yaml, getattr(yaml, 'CSafeLoader', yaml.SafeLoader), getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+    return _yaml
+
+
+def yaml_load(stream):
+    yaml, loader, dumper = _yaml_module()
+    return yaml.load(stream, Loader=loader)
+
+
+def yaml_dump(data, stream=None):
+    yaml, loader, dumper = _yaml_module()
+    return yaml.dump(data, stream, Dumper=dumper, default_flow_style=False)
+
+
+def jsonl_dump(command):
+    return json.dumps(command) + "\n"
+
+
+def format_of(filename):
+    """
+    format of a command file by its extension, None if it is none of ours
+    """
+    for fmt, ext in EXTENSIONS.items():
+        if filename.endswith(ext) or (fmt == 'yaml' and filename.endswith('.yaml')):
+            return fmt
+    return None
+
+
+def _merge_multiple(commands, batch):
+    """
+    merge consecutive /rest/multiple/ commands with the same deploy value
+    into commands of up to batch hosts, other commands pass as they are
+    """
+    pending = None
+    count = 0
+    for cmd in commands:
+        if cmd.get('url') != MULTIPLE_URL:
+            if pending:
+                yield pending
+                pending = None
+            yield cmd
+            continue
+        data = dict(cmd['data'])
+        deploy = data.pop('deploy', None)
+        if pending and (pending['data'].get('deploy') != deploy or count + len(data) > batch):
+            yield pending
+            pending = None
+        if pending is None:
+            pending = {'url': MULTIPLE_URL, 'data': {'deploy': deploy}}
+            count = 0
+        pending['data'].update(data)
+        count += len(data)
+    if pending:
+        yield pending
+
+
+def iter_commands(filename, fmt=None, batch=500):
+    """
+    yield the commands of a command file.
+    JSON Lines files are read line by line, so at most `batch` hosts are
+    in memory at once. yaml files are loaded as a whole (a shard holds
+    one /rest/multiple/ command, there is nothing smaller to stream), so
+    they cost what their records do: --shard-records hosts for a shard,
+    all of them for a --no-split commands.yml.
+    """
+    fmt = fmt or format_of(filename)
+    with open(filename, 'r') as f:
+        if fmt == 'jsonl':
+            lines = (json.loads(line) for line in f if line.strip())
+            for cmd in _merge_multiple(lines, batch):
+                yield cmd
+        else:
+            for cmd in yaml_load(f) or []:
+                yield cmd
@@ -0,0 +1,128 @@
+"""
+local SQLite index of the hosts of all labs, so ldap_search doesn't have
+to go to LDAP. hosts are looked up by any part of their hostname, mac or
+ip through a trigram full text index (when the SQLite at hand has FTS5
+with the trigram tokenizer, otherwise with LIKE).
+"""
+import os
+import time
+import sqlite3
+
+INDEX_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS labs (lab TEXT PRIMARY KEY, built REAL, hosts INTEGER);
+CREATE TABLE IF NOT EXISTS hosts (
+    id INTEGER PRIMARY KEY,
+    lab TEXT NOT NULL,
+    hostname TEXT,
+    mac TEXT,
+    ip TEXT,
+    grp TEXT,
+    dn TEXT
+);
+CREATE INDEX IF NOT EXISTS hosts_lab ON hosts (lab);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS hosts_fts USING fts5(
+    hostname, mac, ip, content='hosts', content_rowid='id', tokenize='trigram'
+);
+"""
+
+
+def default_path():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'penv', 'index.sqlite')
+
+
+class HostIndex(object):
+    """
+    rows are (lab, hostname, mac, ip, group, dn), a lab is always
+    replaced as a whole by store()
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.db = None
+        self.fts = False
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # no fts5 / trigram tokenizer, substrings are matched with LIKE
+            self.fts = False
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None:
+            with self.db:
+                self.db.execute("INSERT INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+        return self
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def store(self, lab, hosts):
+        """
+        replace the hosts of lab with hosts (records.Host), return their number
+        """
+        lab = lab.lower()
+        rows = ((lab, h.hostname, h.mac, h.ip, h.group, h.dn) for h in hosts)
+        with self.db:
+            if self.fts:
+                # the text index only holds a copy, old rows are taken out of it by value
+                self.db.execute("INSERT INTO hosts_fts (hosts_fts, rowid, hostname, mac, ip) "
+                                "SELECT 'delete', id, hostname, mac, ip FROM hosts WHERE lab = ?", (lab,))
+            self.db.execute("DELETE FROM hosts WHERE lab = ?", (lab,))
+            self.db.executemany("INSERT INTO hosts (lab, hostname, mac, ip, grp, dn) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if self.fts:
+                self.db.execute("INSERT INTO hosts_fts (rowid, hostname, mac, ip) "
+                                "SELECT id, hostname, mac, ip FROM hosts WHERE lab = ?", (lab,))
+            count = self.db.execute("SELECT count(*) FROM hosts WHERE lab = ?", (lab,)).fetchone()[0]
+            self.db.execute("INSERT OR REPLACE INTO labs VALUES (?, ?, ?)", (lab, time.time(), count))
+        return count
+
+    def labs(self):
+        """
+        lab -> (time it was indexed, number of hosts)
+        """
+        return dict((lab, (built, hosts)) for lab, built, hosts in self.db.execute("SELECT * FROM labs"))
+
+    def search(self, st, labs=None, limit=None):
+        """
+        hosts whose hostname, mac or ip hold st (case insensitive),
+        as dicts with lab, hostname, mac, ip, group and dn
+        """
+        if self.fts and len(st) >= 3:
+            # a quoted string is a phrase, the trigram tokenizer turns it into a substring match
+            where = "id IN (SELECT rowid FROM hosts_fts WHERE hosts_fts MATCH ?)"
+            args = ['"%s"' % st.replace('"', '""')]
+        else:
+            pattern = '%' + st.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where = "(hostname LIKE ? ESCAPE '\\' OR mac LIKE ? ESCAPE '\\' OR ip LIKE ? ESCAPE '\\')"
+            args = [pattern] * 3
+        if labs:
+            where += " AND lab IN (%s)" % ','.join('?' * len(labs))
+            args += [l.lower() for l in labs]
+        query = "SELECT lab, hostname, mac, ip, grp, dn FROM hosts WHERE %s ORDER BY lab, hostname" % where
+        if limit:
+            query += " LIMIT %d" % limit
+        return [{'lab': lab, 'hostname': hostname, 'mac': mac, 'ip': ip, 'group': grp, 'dn': dn}
+                for lab, hostname, mac, ip, grp, dn in self.db.execute(query, args)]
@@ -0,0 +1,118 @@
+"""
+integer intervals of IPv4 addresses.
+a range is a (first, last) pair of ints, both included. everything here
+works on the ranges themselves, never on the addresses in them, so a /8
+costs what a /30 does.
+"""
+from bisect import bisect_right
+from ipaddress import IPv4Network
+
+from .netindex import ip_to_int, network_range, SubnetIndex
+
+
+def host_range(name, netmask):
+    """
+    (first, last) host address of a subnet, the same addresses
+    IPv4Network.hosts() would list (no network / broadcast address
+    except for /31 and /32)
+    """
+    net = IPv4Network("%s/%s" % (name, netmask))
+    first, last = int(net.network_address), int(net.broadcast_address)
+    if net.prefixlen >= 31:
+        return first, last
+    return first + 1, last - 1
+
+
+def merge(ranges):
+    """
+    sorted, non overlapping ranges covering the same addresses as ranges
+    (adjacent ranges are joined too)
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def clip(ranges, first, last):
+    """
+    the parts of ranges between first and last
+    """
+    return [(max(f, first), min(l, last)) for f, l in ranges if f <= last and l >= first]
+
+
+def subtract(first, last, ranges):
+    """
+    the ranges of first..last not covered by ranges, in order
+    """
+    gaps = []
+    start = first
+    for f, l in merge(clip(ranges, first, last)):
+        if f > start:
+            gaps.append((start, f - 1))
+        start = l + 1
+    if start <= last:
+        gaps.append((start, last))
+    return gaps
+
+
+def size(ranges):
+    """
+    number of addresses in non overlapping ranges
+    """
+    return sum(l - f + 1 for f, l in ranges)
+
+
+class RangeSet(object):
+    """
+    merged ranges with membership lookups by bisect
+    """
+
+    def __init__(self, ranges=()):
+        self.ranges = merge(ranges)
+        self._starts = [f for f, l in self.ranges]
+
+    def __contains__(self, ip):
+        i = bisect_right(self._starts, ip) - 1
+        return i >= 0 and ip <= self.ranges[i][1]
+
+    def __len__(self):
+        return size(self.ranges)
+
+
+def subnet_utilization(subnets, pools, ips):
+    """
+    address usage of every subnet:
+    size - host addresses of the subnet
+    dynamic - addresses in the ranges of its pools
+    used - distinct host addresses given to hosts
+    static - used addresses outside the pools
+    free - addresses neither dynamic nor used
+    subnets - Subnet records, pools - Pool records, ips - host addresses (ints)
+    return a list of dicts, one per subnet, in the order of subnets
+    """
+    pool_ranges = dict()
+    for p in pools:
+        pool_ranges.setdefault(p.subnet_name, []).append((ip_to_int(p.range_min), ip_to_int(p.range_max)))
+
+    index = SubnetIndex((s.name,) + network_range(s.name, s.netmask) for s in subnets)
+    ips = sorted(set(ips))
+    per_subnet = dict()
+    for ip, name in zip(ips, index.lookup_many(ips)):
+        if name is not None:
+            per_subnet.setdefault(name, []).append(ip)
+
+    report = []
+    for s in subnets:
+        first, last = host_range(s.name, s.netmask)
+        dynamic = RangeSet(clip(pool_ranges.get(s.name, []), first, last))
+        used = [ip for ip in per_subnet.get(s.name, []) if first <= ip <= last]
+        static = sum(1 for ip in used if ip not in dynamic)
+        total = last - first + 1
+        report.append({'subnet': s.name, 'netmask': s.netmask, 'size': total, 'dynamic': len(dynamic),
+                       'used': len(used), 'static': static, 'free': total - len(dynamic) - static})
+    return report
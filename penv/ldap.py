@@ -1,14 +1,37 @@
 #!/usr/local/bin/python3
 
 import os
+import io
+import json
 import click
 import ldap
-import json
-import yaml
-import requests
-from requests.exceptions import ConnectionError
-from ipaddress import IPv4Address, IPv4Network, summarize_address_range
+from ldap.controls import SimplePagedResultsControl
 import datetime
+from .cache import SnapshotCache
+from .sync import SyncState
+from .records import Group, Subnet, Pool, Host, parse_entries
+from .parallel import map_chunks, host_chunk, parse_entries_parallel
+from .netindex import SubnetIndex, network_range, ip_to_int, int_to_ip
+from .intervals import host_range, subtract, subnet_utilization
+from .index import HostIndex
+from .diff import item_url, write_diff
+from .connections import ConnectionManager
+from .sanity import SanityChecker, text_report
+from .profiling import profiled, iterate, add
+from .writer import HOST_WRITERS, ShardWriter, TeeWriter, write_skeleton, remove_shards, SKELETON_SECTIONS
+from .formats import yaml_load, yaml_dump, format_of, FORMATS, EXTENSIONS
+
+# filters and attribute lists for each use of the LDAP data, so only
+# the entries and attributes a command actually reads are pulled
+ALL_FILTER = '(objectClass=*)'
+SKELETON_FILTER = '(|(objectClass=dhcpGroup)(objectClass=dhcpSubnet)(objectClass=dhcpPool))'
+SKELETON_ATTRS = ['objectClass', 'cn', 'dhcpNetMask', 'dhcpOption', 'dhcpStatements', 'dhcpComments', 'dhcpRange']
+HOSTS_FILTER = '(objectClass=dhcpHost)'
+HOSTS_ATTRS = ['objectClass', 'cn', 'dhcpHWAddress', 'dhcpStatements']
+SUBNETS_FILTER = '(objectClass=dhcpSubnet)'
+SUBNETS_ATTRS = ['objectClass', 'cn', 'dhcpNetMask']
+# attributes ldap_search looks into (and brings back)
+SEARCH_ATTRS = ['cn', 'dhcpHWAddress', 'dhcpStatements']
 
 class Ldap(object):
 
@@ -45,154 +68,328 @@ class Ldap(object):
         self.host = None
         self.username = None
         self.password = None
+        # number of entries per LDAP page, 0 means a single unpaged search
+        self.page_size = 1000
+        # SnapshotCache, when set pulls are served from / stored to it
+        self.cache = None
+        # ignore fresh snapshots and pull again
+        self.refresh = False
+        # never touch LDAP, only serve from snapshots
+        self.offline = False
+        # bound connections, shared by the copies of this handle
+        self.connections = ConnectionManager()
+
+    def copy(self):
+        """
+        a new, unconnected handle with the same credentials and settings,
+        for working on several labs at once
+        """
+        other = Ldap()
+        for attr in ('username', 'password', 'page_size', 'cache', 'refresh', 'offline', 'connections'):
+            setattr(other, attr, getattr(self, attr))
+        return other
 
-    def connect(self, lab):
+    def check_lab(self, lab):
         if lab.lower() not in self.labs:
             click.secho("Lab %s is not a valid option" % lab, fg='red')
             raise click.UsageError("Please only use next option for --lab: %s" % list(self.labs.keys()))
-        else:
-            self.lab = lab
-            self.host =  self.labs[self.lab.lower()][0]
-            self.basedn = self.labs[self.lab.lower()][1]
 
-        click.secho('Connecting LDAP in lab %s' % lab, fg='blue')
+    def unique_labs(self, labs):
+        """
+        labs in the same order, without the ones reaching the same
+        server and basedn as an earlier one (gdc is infi1)
+        """
+        for lab in labs:
+            self.check_lab(lab)
+        seen = set()
+        unique = []
+        for lab in labs:
+            target = tuple(self.labs[lab.lower()])
+            if target not in seen:
+                seen.add(target)
+                unique.append(lab)
+        return unique
+
+    def aliases(self, lab):
+        """
+        labs reaching the same server and basedn as lab, lab included
+        """
+        self.check_lab(lab)
+        target = self.labs[lab.lower()]
+        return [l for l in self.labs if self.labs[l] == target]
+
+    def connect(self, lab):
+        self.check_lab(lab)
+        self.lab = lab
+        self.host =  self.labs[self.lab.lower()][0]
+        self.basedn = self.labs[self.lab.lower()][1]
+
+        self.ldap = None
+        if self.offline:
+            click.secho('Offline, using cached snapshots of lab %s' % lab, fg='blue')
+        elif not self.cache:
+            self.bind()
+        # with a snapshot cache, binding waits for the first pull
+        # that can't be served from a fresh snapshot
 
-        ldapi = "ldap://" + self.host + ":389"
-        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
-        self.ldap = ldap.initialize(ldapi)
-        self.ldap.set_option(ldap.OPT_REFERRALS, 0)
-        self.ldap.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
-        self.ldap.set_option(ldap.OPT_X_TLS, ldap.OPT_X_TLS_DEMAND)
-        self.ldap.set_option(ldap.OPT_X_TLS_DEMAND, False)
-        self.ldap.set_option(ldap.OPT_DEBUG_LEVEL, 255)
+    @profiled('connect')
+    def bind(self):
+        click.secho('Connecting LDAP in lab %s' % self.lab, fg='blue')
 
         binddn = "cn=" + self.username + "," + self.basedns[self.lab.lower()]
         try:
-            self.ldap.simple_bind_s(binddn, self.password)
+            # labs on the same server (infi1 / gdc) share one connection
+            self.ldap = self.connections.get(self.host, binddn, self.password)
         except ldap.INVALID_CREDENTIALS:
             click.secho("Your username or password is incorrect.", fg='red')
-            click.Abort()
+            raise click.Abort()
         except ldap.LDAPError as e:
-            if type(e.message) == dict and e.message.has_key('desc'):
-                click.secho(e.message['desc'], fg='red')
+            info = e.args[0] if e.args else None
+            if isinstance(info, dict) and 'desc' in info:
+                click.secho(info['desc'], fg='red')
             else:
                 click.echo(e)
-                click.Abort()
-
+            raise click.Abort()
 
-    def pull_dhcp_data(self):
+    def from_cache(self, filterstr, attrlist):
+        """
+        return (entries, key, snapshot): entries of a snapshot of this pull
+        that can be used instead of LDAP (None if there is none), and the
+        key and file of the snapshot to store the pull to
+        """
+        key = self.cache.key(self.lab, self.host, self.basedn, filterstr, attrlist)
+        snapshot = self.cache.filename(key)
+        age = self.cache.age(snapshot)
+        if self.offline:
+            if age is None:
+                click.secho("No cached snapshot of lab %s, can't work offline" % self.lab, fg='red')
+                raise click.Abort()
+            click.secho('Using snapshot from %d seconds ago' % age, fg='yellow')
+            return self.cache.read(snapshot), key, snapshot
+        if not self.refresh and age is not None and age < self.cache.ttl:
+            click.secho('Using snapshot from %d seconds ago' % age, fg='yellow')
+            return self.cache.read(snapshot), key, snapshot
+        return None, key, snapshot
+
+    def pull_dhcp_data(self, filterstr=ALL_FILTER, attrlist=None, use_cache=True):
+        """
+        return a generator over the LDAP entries of the connected lab
+        matching filterstr, holding only the attributes in attrlist
+        (all attributes when attrlist is None).
+        when page_size is set, entries are requested page by page using the
+        Simple Paged Results control, so only one page is kept in memory and
+        consumers can start working on the first page while the next ones
+        are still on their way.
+        use_cache=False bypasses the snapshot cache (one-off pulls).
+        """
 
         if not self.lab:
             click.secho("No lab was provided", fg='red')
             raise click.Abort()
 
-        return self.ldap.search_s(self.basedn, ldap.SCOPE_SUBTREE, '(objectClass=*)')
+        cache = self.cache if use_cache else None
+        if self.offline and not cache:
+            click.secho("This pull can't be served offline", fg='red')
+            raise click.Abort()
 
-    def process_raw(self, data=None, deploy=False, sample=False, sanity=False):
+        if cache:
+            entries, key, snapshot = self.from_cache(filterstr, attrlist)
+            if entries is not None:
+                return iterate('pull_dhcp_data', entries)
+
+        if self.ldap is None:
+            self.bind()
+        if not self.page_size:
+            entries = iter(self.ldap.search_s(self.basedn, ldap.SCOPE_SUBTREE, filterstr, attrlist))
+        else:
+            entries = self.paged_search(self.basedn, filterstr, attrlist)
+
+        if cache:
+            entries = cache.store(snapshot, key, entries)
+        return iterate('pull_dhcp_data', entries)
+
+    @profiled('pull_labs')
+    def pull_labs(self, labs, filterstr=ALL_FILTER, attrlist=None, use_cache=True):
+        """
+        the same pull from several labs, return lab -> list of entries.
+        what can't be served from snapshots is searched on all the servers
+        at once (see ConnectionManager.search_many).
+        """
+        if self.offline and not use_cache:
+            click.secho("This pull can't be served offline", fg='red')
+            raise click.Abort()
+        results = dict()
+        searches = []
+        handles = dict()
+        for lab in labs:
+            handle = self.copy()
+            handle.cache = self.cache if use_cache else None
+            handle.connect(lab)
+            if handle.cache:
+                entries, key, snapshot = handle.from_cache(filterstr, attrlist)
+                if entries is not None:
+                    results[lab] = list(entries)
+                    continue
+                handles[lab] = (handle, key, snapshot)
+            else:
+                handles[lab] = (handle, None, None)
+            if handle.ldap is None:
+                handle.bind()
+            searches.append((lab, handle.ldap, handle.basedn, filterstr, attrlist))
+
+        for lab, entries in self.connections.search_many(searches, self.page_size).items():
+            handle, key, snapshot = handles[lab]
+            if handle.cache:
+                entries = list(handle.cache.store(snapshot, key, entries))
+            results[lab] = entries
+        add(records=sum(len(entries) for entries in results.values()))
+        return results
+
+    def pull_dhcp_changes(self, state):
+        """
+        pull only the host entries that changed since state.hwm
+        (by modifyTimestamp) and merge them into the state.
+        deletions are found by listing the dns currently in LDAP, a search
+        as long as the lab is big whatever changed.
+        return (changed entries, deleted entries).
+        without a high-water mark everything is pulled.
+        """
+        attrs = HOSTS_ATTRS + ['modifyTimestamp']
+        if state.hwm is None:
+            click.secho('No previous sync of lab %s, pulling everything' % self.lab, fg='yellow')
+            changed = list(self.pull_dhcp_data(HOSTS_FILTER, attrs, use_cache=False))
+            present = None
+        else:
+            click.secho('Pulling changes since %s' % state.hwm, fg='green')
+            filterstr = '(&%s(modifyTimestamp>=%s))' % (HOSTS_FILTER, state.hwm)
+            changed = list(self.pull_dhcp_data(filterstr, attrs, use_cache=False))
+            # '1.1' - no attributes, dns only
+            present = set(e[0] for e in self.pull_dhcp_data(HOSTS_FILTER, ['1.1'], use_cache=False))
+        changed, deleted = state.merge(changed, present)
+        click.secho('%s changed, %s deleted entries' % (len(changed), len(deleted)), fg='green')
+        return changed, deleted
+
+    def paged_search(self, basedn, filterstr, attrlist=None):
+        """
+        yield search results one page at a time.
+        referrals (entries without a dn) are dropped.
+        """
+        ctrl = SimplePagedResultsControl(True, size=self.page_size, cookie='')
+        while True:
+            msgid = self.ldap.search_ext(basedn, ldap.SCOPE_SUBTREE, filterstr, attrlist, serverctrls=[ctrl])
+            rtype, rdata, rmsgid, serverctrls = self.ldap.result3(msgid)
+            for e in rdata:
+                if e[0] is not None:
+                    yield e
+            pctrls = [c for c in serverctrls if c.controlType == SimplePagedResultsControl.controlType]
+            if not pctrls or not pctrls[0].cookie:
+                # last page
+                break
+            ctrl.cookie = pctrls[0].cookie
+
+    @profiled('subnet_index')
+    def subnet_index(self, skeleton=None):
+        """
+        index the lab's subnets for IP -> subnet lookups.
+        skeleton - sections of extract_skeleton, its subnets are indexed
+        instead of pulling them again
+        """
+        if skeleton is not None:
+            return SubnetIndex((c['data']['name'],) + network_range(c['data']['name'], c['data']['netmask'])
+                               for c in skeleton['subnets'])
+        subnets = [rec for rec in parse_entries(self.pull_dhcp_data(SUBNETS_FILTER, SUBNETS_ATTRS))
+                   if isinstance(rec, Subnet)]
+        return SubnetIndex.from_subnets(subnets)
+
+    @profiled('process_raw')
+    def process_raw(self, data=None, deploy=False, sample=False, subnets=None, out=None, writer=None, fmt='yaml',
+                    workers=0):
         """
         method for taking raw data from ldap and
         disect to smaller pieces.
+        subnets - SubnetIndex, when given every host with an ip
+        also gets the subnet holding it.
+        out - file handle (or callable taking a string) the host command
+        is streamed to while the data is parsed. without it the command
+        is returned as a string.
+        writer - HostWriter like object (ShardWriter) taking the hosts instead.
+        fmt - yaml / jsonl, format of the command written to out
+        workers - parse on this many processes (see parallel.py),
+        -1 one per core, 0 (default) here
         """
-        counter = 0
-        hosts_str = ''
-        if not deploy:
-            # dont deploy to LDAP
-            deployed = False
-            cmd_str = "- url: /rest/multiple/\n"+" "*2 +"data: " + \
-                      " " +"{\n" + " "*8 + "\"deploy\": \"False\",\n" + " "*8
-        else:
-            # deploy to LDAP
-            deployed = True
-            cmd_str = "- url: /rest/multiple/\n"+" "*2 +"data: " + " " +"{\n" + "\"deploy\": \"True\",\n"
-
-        mac_dict = dict()
-        ip_dict = dict()
-        self.skl_subnets_dict = {}
-        # skldata is a list of subnets ,each item in the list
-        # is all the data we have on a subnet from LDAP
-        # including ip, mask, etc..
-        skldata = yaml.load(self.extract_skeleton(data, fullskl=False))
-        for s in skldata:
-            name = s['data']['name']
-            mask = s['data']['netmask']
-            self.skl_subnets_dict[name] = IPv4Network("%s/%s" % (name, mask))
+        buf = None
+        if writer is None:
+            if out is None:
+                buf = io.StringIO()
+                writer = HOST_WRITERS[fmt](buf, deploy)
+            else:
+                writer = HOST_WRITERS[fmt](out, deploy)
+
+        macs = set()
 
         click.secho("LDAP raw data extraction")
-        for e in data:
-            if 'dhcpHost' in [el.decode('utf-8') for el in e[1]['objectClass']]:
-                cn = e[0].split(',')
-                hostname = e[1]['cn'][0].decode('utf-8')
-                group_name = e[0].split(',')[1].split('=')[1]
-                if 'dhcpHWAddress' in e[1]:
-                    mac = e[1]['dhcpHWAddress'][0].split()[1].decode('utf-8')
-                    if not mac in mac_dict:
-                        mac_dict[mac] = []
-                        if 'dhcpStatements' in e[1]:
-                            ip = e[1]['dhcpStatements'][0].split()[1].decode('utf-8')
-                            if not ip in ip_dict:
-                                ip_dict[ip] = []
-                            data = json.dumps({'ip':ip })
-                            # subnet = self.get_subnet_from_ip(IPv4Address(ip), self.skl_subnets_dict)
-                            # if not subnet:
-                            #     continue
-                            # # try:
-                                # subnet = requests.get('http://127.0.0.1:5000/query/subnets/query_subnet_from_ip/', data=data).text
-                            # except ConnectionError as e:
-                                # click.secho('Please check cob testserver is running on localhost port 5000', fg='red')
-                                # raise click.Abort()
-                            # if 'Bad Request' in subnet:
-                                # continue
-                        else:
-                            ip = None
-                        if ip:
-                            # hosts_str += "h" + str(counter) + ": " + \
-                            #              "{hostname: \"%s\", mac: \"%s\", group: \"%s\", subnet: %s, ip: \"%s\", deployed: %s },\n" \
-                            #              % (hostname, mac, group_name, subnet.strip(), ip, deployed) + " "*9
-
-                            hosts_str += "h" + str(counter) + ": " + \
-                                         "{hostname: \"%s\", mac: \"%s\", group: \"%s\", ip: \"%s\", deployed: %s },\n" \
-                                         % (hostname, mac, group_name, ip, deployed) + " "*9
-
-
-                            ip_dict[ip].append(hostname)
-                            mac_dict[mac].append(hostname)
-                        else:
-                            hosts_str += "h" + str(counter) + ": " + \
-                                         "{hostname: \"%s\", mac: \"%s\", group: \"%s\", deployed: %s },\n" \
-                                         % (hostname, mac, group_name, deployed) + " " * 9
-                            mac_dict[mac].append(hostname)
-
-                        counter += 1
-                        if sample and counter > 10:
-                            break
-
-        cmd_str += " "*8 +"%s\n" % hosts_str + " "*8 +"}"
-        if sanity:
-            return ip_dict, mac_dict
+        if workers:
+            # chunks come back in order, so the first host of a mac is the same one
+            hosts = (h for chunk in map_chunks(host_chunk, data, workers if workers > 0 else None, subnets=subnets)
+                     for h in chunk)
         else:
-            return cmd_str
+            hosts = self.iter_hosts(data, subnets)
+        writer.begin()
+        for hostname, mac, group, ip, subnet in hosts:
+            # first host holding a mac wins
+            if mac in macs:
+                continue
+            macs.add(mac)
+            writer.host(hostname, mac, group, ip, subnet)
+            if sample and writer.count > 10:
+                break
+        writer.end()
+        add(records=writer.count)
+
+        if buf is not None:
+            return buf.getvalue()
+
+    def iter_hosts(self, data, subnets=None):
+        """
+        (hostname, mac, group, ip, subnet) of every host with a mac in data
+        """
+        for rec in parse_entries(data):
+            if not isinstance(rec, Host) or rec.mac is None:
+                continue
+            subnet = None
+            if rec.ip:
+                if subnets is not None:
+                    try:
+                        subnet = self.get_subnet_from_ip(rec.ip, subnets)
+                    except ValueError:
+                        # a fixed-address given as a hostname has no subnet of ours
+                        subnet = None
+            yield rec.hostname, rec.mac, rec.group, rec.ip, subnet
+
+    def deleted_hosts(self, deleted):
+        """
+        DHCPawn DELETE commands (as diff.py makes them) of every dhcpHost
+        in a list of deleted entries
+        """
+        return [{'method': 'DELETE', 'url': item_url('hosts', rec.hostname), 'data': {}}
+                for rec in parse_entries(deleted) if isinstance(rec, Host)]
 
 #~~~~~~~~~~~ SANITY REPORT ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    def sanity_report(self, data):
-
-        report_str = ''
-        ip_dict, mac_dict = self.process_raw(data, True, False, True)
-        report_str += "IP DUPS\n"
-        # print("IP DUPS")
-        for i in ip_dict:
-            if len(ip_dict[i]) > 1:
-                report_str += '%s, %s \n' % (i, ip_dict[i])
-                # print(i, ip_dict[i])
-        report_str += 'MAC DUPS\n'
-        # print("MAC DUPS")
-        for m in mac_dict:
-            if len(mac_dict[m]) > 1:
-                report_str += '%s, %s \n' % (m, mac_dict[m])
-                # print(m, mac_dict[m])
-        return report_str
+    @profiled('sanity_report')
+    def sanity_report(self, data, skeleton=()):
+        """
+        check hosts (data) against each other and against the subnets and
+        pools in skeleton (raw entries), return the report (see sanity.py)
+        """
+        checker = SanityChecker()
+        checker.add_all(parse_entries(skeleton))
+        checker.add_all(parse_entries(data))
+        return checker.check()
+
 #~~~~~~~~~~~~~~~~~~~~~~~~ SKELETON ~~~~~~~~~~~~~~~~~~~~~~~~~~
-    def extract_skeleton(self, rawdata=None, ofile=None, deploy=False, fullskl=True):
+    @profiled('extract_skeleton')
+    def extract_skeleton(self, rawdata=None, ofile=None, deploy=False, out=None, fmt='yaml', workers=0):
         """
         return a dict containing all relevant info about subnets ,groups
         and also add dhcpranges and calculated ranges.
@@ -200,121 +397,80 @@ class Ldap(object):
         groups
         pools, dhcp ranges
         calculated ranges
+        the skeleton is written in fmt (yaml / jsonl) to ofile, or to
+        out (file handle or callable taking a string) when given, and
+        returned as a dict of section name -> commands.
+        workers - parse on this many processes, as in process_raw
         """
 
-        groups = ""
-        subnets = ""
-        pools = ""
-        dhcpranges = ""
-        calcranges = ""
+        sections = dict((name, []) for name in SKELETON_SECTIONS)
 
-        if fullskl:
-            click.secho("Processing raw data and extracting the skeleton")
-        else:
-            click.secho("Extracting only subnets from skeleton for raw data processing")
+        click.secho("Processing raw data and extracting the skeleton")
         if rawdata == None:
             click.Abort("missing rawdata for skeleton extraction")
 
         s = dict()
         p = dict()
-        for e in rawdata:
-           if 'dhcpGroup' in [el.decode('utf-8') for el in e[1]['objectClass']]:
-               name = e[1]['cn'][0].decode('utf-8')
-               url = '/rest/groups/'
-               groups += yaml.dump([{'url':url, 'data': {'name':name, 'deployed':deploy}}])
-               # click.secho(data, fg='red')
-           elif 'dhcpSubnet' in [el.decode('utf-8') for el in e[1]['objectClass']]:
-               name = e[1]['cn'][0].decode('utf-8')
-               url = '/rest/subnets/'
-               routers = ''
-               ddns_domainname = ''
-               netmask = e[1]['dhcpNetMask'][0].decode('utf-8')
-
-               if e[1].get('dhcpOption'):
-                   for item in e[1]['dhcpOption']:
-                       if item.decode('utf-8').startswith('routers'):
-                           routers = ','.join(item.decode('utf-8').replace(",","").split(" ")[1:]) # taking only the default gateway ip , excluding the "routers" word.
-               if e[1].get('dhcpStatements'):
-                   for item in e[1]['dhcpStatements']:
-                       if item.decode('utf-8').startswith('ddns-domainname'):
-                           ddns_domainname = item.decode('utf-8').split()[1].replace("\"","")
-
-               # import pudb;pudb.set_trace()
-               # options = {'dhcpComments': [e[1]['dhcpComments'][0].decode('utf-8')], 'dhcpRouters': [routers], 'ddns-domainname': [ddns_domainname]}
-               options = {
-                   'dhcpComments': [e[1]['dhcpComments'][0].decode('utf-8')],
-                   'dhcpStatements': ['ddns-domainname %s' % ddns_domainname],
-                   'dhcpOption': ['routers %s' % routers]
-               }
-               subnets += yaml.dump([{'url': url, 'data': {'name':name, 'netmask':netmask, 'options':options, 'deployed':deploy}}])
-               s[name] = {'netmask':netmask}
-               # click.secho(data, fg='yellow')
-           elif 'dhcpPool' in [el.decode('utf-8') for el in e[1]['objectClass']]:
-               name = e[1]['cn'][0].decode('utf-8')
-               url = '/rest/pools/'
-               subnet_name = e[0].replace(",","").split("cn=")[2]
-               pools += yaml.dump([{'url':url, 'data': {'name':name, 'subnet_name':subnet_name, 'deployed':deploy}}])
-               min_dhcprange = e[1]['dhcpRange'][0].split()[0].decode('utf-8')
-               max_dhcprange = e[1]['dhcpRange'][0].split()[1].decode('utf-8')
-               dhcpranges += yaml.dump([{'url':'/rest/dhcpranges/', 'data': {'min':min_dhcprange, 'max':max_dhcprange, 'pool_name':name, 'deployed':deploy}}])
-               p[subnet_name] = {'mindhcp':min_dhcprange, 'maxdhcp':max_dhcprange}
-
-        # Calculate and create calcranges yml
+        if workers:
+            records = parse_entries_parallel(rawdata, workers if workers > 0 else None)
+        else:
+            records = parse_entries(rawdata)
+        for rec in records:
+            if isinstance(rec, Group):
+                url = '/rest/groups/'
+                sections['groups'].append({'url':url, 'data': {'name':rec.name, 'deployed':deploy}})
+            elif isinstance(rec, Subnet):
+                url = '/rest/subnets/'
+                options = {
+                    'dhcpComments': [rec.comments],
+                    'dhcpStatements': ['ddns-domainname %s' % rec.ddns_domainname],
+                    'dhcpOption': ['routers %s' % rec.routers]
+                }
+                sections['subnets'].append({'url': url, 'data': {'name':rec.name, 'netmask':rec.netmask, 'options':options, 'deployed':deploy}})
+                s[rec.name] = {'netmask':rec.netmask}
+            elif isinstance(rec, Pool):
+                url = '/rest/pools/'
+                sections['pools'].append({'url':url, 'data': {'name':rec.name, 'subnet_name':rec.subnet_name, 'deployed':deploy}})
+                sections['dhcpranges'].append({'url':'/rest/dhcpranges/', 'data': {'min':rec.range_min, 'max':rec.range_max, 'pool_name':rec.name, 'deployed':deploy}})
+                p.setdefault(rec.subnet_name, []).append((ip_to_int(rec.range_min), ip_to_int(rec.range_max)))
+
+        # Calculate and create calcranges yml:
+        # the parts of every subnet no pool covers
         for sub in s:
             sname = sub
-            smask = s[sub]['netmask']
-            mind = p[sub]['mindhcp']
-            maxd = p[sub]['maxdhcp']
-            lastip = list(IPv4Network("%s/%s" % (sname,smask)).hosts())[-1]
-            ranges = [[IPv4Address(sname)+1,IPv4Address(mind)-1], [IPv4Address(maxd)+1, lastip]]
-
-            # lower range
-            if ranges[0][1] > ranges[0][0]:
-                #click.echo("create crange for lower")
-                calcranges += yaml.dump([{'url':'/rest/calcranges/', 'data': {'subnet_name':sname, 'min':str(ranges[0][0]),'max':str(ranges[0][1]), 'deployed':deploy}}])
-            # upper range
-            if ranges[1][1] > ranges[1][0]:
-                #click.echo("create crange for upper")
-                calcranges += yaml.dump([{'url':'/rest/calcranges/', 'data': {'subnet_name':sname, 'min':str(ranges[1][0]),'max':str(ranges[1][1]), 'deployed':deploy}}])
-
-        if fullskl:
+            first, last = host_range(sname, s[sub]['netmask'])
+            for gap in subtract(first, last, p.get(sub, [])):
+                # single addresses never got a calcrange
+                if gap[1] > gap[0]:
+                    sections['calcranges'].append({'url':'/rest/calcranges/', 'data': {'subnet_name':sname, 'min':int_to_ip(gap[0]),'max':int_to_ip(gap[1]), 'deployed':deploy}})
+        add(records=sum(len(section) for section in sections.values()))
+
+        if out is not None:
+            write_skeleton(out, sections, fmt)
+        elif ofile:
             with open(ofile, 'w') as stream:
-                stream.write("---\n")
-                stream.write(self.ymlcomment('subnets'))
-                stream.write(subnets)
-                stream.write(self.ymlcomment('pools'))
-                stream.write(pools)
-                stream.write(self.ymlcomment('dhcpranges'))
-                stream.write(dhcpranges)
-                stream.write(self.ymlcomment('calcranges'))
-                stream.write(calcranges)
-                stream.write(self.ymlcomment('groups'))
-                stream.write(groups)
-                stream.write("...")
-        else:
-            # only need to return subnets for ip > subnet calculation
-            return subnets
+                write_skeleton(stream, sections, fmt)
+            add(bytes=os.path.getsize(ofile))
+        return sections
 
-    def get_subnet_from_ip(self, ip, skldict):
+    def get_subnet_from_ip(self, ip, index):
         """
-        skldict :dict of generators we get from IPv4network.hosts() when keys are subnet names
-        ip: IPv4address obj
+        index: SubnetIndex of the lab's subnets
+        ip: dotted string, int or IPv4address obj
+        return the name of the most specific subnet holding ip, or None
         """
-        for s in skldict:
-            if ip in skldict[s]:
-                # click.secho("%s in %s" % (ip, s), fg='red')
-                return s
-        # click.secho("no subnet found for ip %s" % ip, fg='yellow')
-        return None
+        return index.lookup(ip)
 
 #~~~~~~~~~~~~~~~~~~~~~~~ SPLIT STUFF ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     def write_small_yml(self, fname, odir, info):
 
         with open(odir+"/"+fname, 'w') as fh:
             # click.secho("Creating %s" % fname, fg='blue')
-            fh.write(yaml.dump(info))
+            yaml_dump(info, fh)
+            add(records=len(info[0]['data']) - 1, bytes=fh.tell())
 
 
+    @profiled('split_yml')
     def split_yml(self, ymlfile, number=500):
         """
          split a yaml file into smaller yaml files so that i can
@@ -324,9 +480,10 @@ class Ldap(object):
         """
         with open(ymlfile, 'r') as y:
             click.secho("Loading YAML", fg='green')
-            loaded = yaml.load(y)
+            loaded = yaml_load(y)
 
         click.secho("Will be writing all yml files to %s" % os.path.dirname(ymlfile))
+        remove_shards(os.path.dirname(ymlfile))
         url = loaded[0]['url']
         deploy = loaded[0]['data'].get('deploy')
         record_count = 0
@@ -356,25 +513,32 @@ class Ldap(object):
             # incase we have less then 500 records but we reached the end of the main yml
             self.write_small_yml("%s%s.yml" % (name, str(file_count)), os.path.dirname(ymlfile), small_yml)
 
-    def ymlcomment(self, text):
-        return "#"*10 + "\n# %s\n" % text + "#"*10 + "\n"
-
 ######################################################################
 
 @click.group()
 @click.option('-u', '--username', help='username for LDAP access', required=True)
 @click.option('-p', '--password', prompt=True, hide_input=True, help='password for LDAP access', required=True)
+@click.option('--page-size', default=1000, help='LDAP entries per page (0 = no paging, one big search)')
+@click.option('--cache-dir', default=None, help='where LDAP snapshots are kept (default ~/.cache/penv/snapshots)')
+@click.option('--cache-ttl', default=300, help='seconds a snapshot is considered fresh (0 = no cache)')
+@click.option('--refresh', is_flag=True, default=False, help='pull from LDAP even if a fresh snapshot exists')
+@click.option('--offline', is_flag=True, default=False, help='only use cached snapshots, never connect to LDAP')
+@click.option('--debug', is_flag=True, default=False, help='trace the LDAP protocol (very verbose)')
 @click.pass_context
-def dhcpldap(ctx, username, password):
+def dhcpldap(ctx, username, password, page_size, cache_dir, cache_ttl, refresh, offline, debug):
 
     ctx.obj = Ldap()
     ctx.obj.username = username
     ctx.obj.password = password
+    ctx.obj.page_size = page_size
+    if cache_ttl or offline:
+        ctx.obj.cache = SnapshotCache(cache_dir, cache_ttl)
+    ctx.obj.refresh = refresh
+    ctx.obj.offline = offline
+    ctx.obj.connections = ConnectionManager(debug)
+    ctx.call_on_close(ctx.obj.connections.close)
     # ctx.obj.connect(lab)
 
-@click.group()
-def dhcpawn():
-    pass
 # @click.group()
 # @click.option('-y','--yaml', help='path to YAML file')
 # @click.pass_context
@@ -392,14 +556,33 @@ def dhcpawn():
 @click.option('--deploy/--no-deploy', default=False, help='deploy to LDAP or not. default is False')
 @click.option('--sample/--no-sample', default=False, help='meant for testing ,will only return 10 records from ldap to see the output is right')
 @click.option('--skeleton/--no-skeleton', default=True, help='By default, LDAP skeleton will also be extracted')
-@click.option('--split/--no-split', default=True, help="By default split LDAP info file to smaller files")
+@click.option('--split/--no-split', default=True, help="By default write the hosts to smaller ymlcmdN.yml shard files")
+@click.option('--shard-records', default=500, help='max number of hosts in each shard file')
+@click.option('--shard-bytes', default=0, help='max size of each shard file in bytes (0 = no limit)')
 @click.option('--ofile', default='commands.yml' , help='output file to which ldap data is written')
 @click.option('--odir', default='.', help='output dir')
+@click.option('--incremental/--no-incremental', default=False, help='only export hosts changed since the last incremental run in odir '
+              '(finding deleted hosts still lists the dn of every host of the lab)')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='yaml',
+              help='yaml (default) or jsonl (JSON Lines, populate reads it line by line, yaml files are loaded whole) output')
+@click.option('--push/--no-push', default=False, help='post the data to DHCPawn while it is pulled')
+@click.option('--write-files/--no-write-files', default=None, help='write the files too when pushing (default only without --push)')
+@click.option("--host", help="Host running DHCPawn (with --push)", default="localhost")
+@click.option("--port", help="Port on host running DHCPawn (with --push)", default=8000)
+@click.option('--workers', default=8, help='number of concurrent requests to DHCPawn (with --push)')
+@click.option('--batch-size', default=500, help='hosts per /rest/multiple/ request to start with (with --push)')
+@click.option('--queue-size', default=1000, help='parsed hosts waiting to be posted at most (with --push)')
+@click.option('--parse-workers', default=0, help='parse the entries on this many processes (-1 = one per core, 0 = no pool)')
 @click.pass_obj
-def ldap_to_yml(ldaph, lab, raw, deploy, ofile, odir, sample, skeleton, split):
+@profiled('ldap_to_yml')
+def ldap_to_yml(ldaph, lab, raw, deploy, ofile, odir, sample, skeleton, split, shard_records, shard_bytes, incremental, fmt,
+                push, write_files, host, port, workers, batch_size, queue_size, parse_workers):
     '''
-    bring ldap data by default to a file called commands.yml.
-    by default also split to smaller yml files.
+    bring ldap data by default to shard files ymlcmdN.yml (listed in
+    manifest.yml), or with --no-split to a single file called commands.yml.
+    with --format jsonl the files are .jsonl instead.
+    with --push the skeleton and hosts are posted to DHCPawn as they are
+    pulled (files are only written with --write-files).
     '''
     click.secho("start %s" % datetime.datetime.ctime(datetime.datetime.now()), fg='yellow')
     if raw and not ofile:
@@ -409,29 +592,111 @@ def ldap_to_yml(ldaph, lab, raw, deploy, ofile, odir, sample, skeleton, split):
         click.secho("Please provide a valid output dir", fg='red')
         raise click.Abort()
 
+    if write_files is None:
+        write_files = not push
+    if not push and not write_files:
+        click.secho("Without --push the data can only go to files", fg='red')
+        raise click.Abort()
+
+    if format_of(ofile) != fmt:
+        ofile = os.path.splitext(ofile)[0] + EXTENSIONS[fmt]
     ofile = os.path.abspath(odir) + "/" + ofile
 
     ldaph.connect(lab)
-    click.secho('Retrieving LDAP raw data', fg='green')
-    ldap_raw_data = ldaph.pull_dhcp_data()
     # click.echo("deploy is %s" % deploy)
     if skeleton:
-        skeleton_file = os.path.dirname(os.path.abspath(ofile))+"/"+"skeleton.yml"
+        skeleton_file = os.path.dirname(os.path.abspath(ofile))+"/"+"skeleton"+EXTENSIONS[fmt]
+        click.secho('Retrieving LDAP skeleton data', fg='green')
+        skeleton_raw_data = ldaph.pull_dhcp_data(SKELETON_FILTER, SKELETON_ATTRS)
         click.secho('Extracting Skeleton', fg='blue')
-        skeleton = ldaph.extract_skeleton(rawdata=ldap_raw_data, ofile=skeleton_file, deploy=deploy , fullskl=True)
-        click.secho('Skeleton is ready in %s' % skeleton_file , fg='blue')
-
-    with open(ofile, 'w') as f:
+        skeleton = ldaph.extract_skeleton(rawdata=skeleton_raw_data, ofile=skeleton_file if write_files else None,
+                                          deploy=deploy , fmt=fmt, workers=parse_workers)
+        if write_files:
+            click.secho('Skeleton is ready in %s' % skeleton_file , fg='blue')
 
-        f.write(ldaph.process_raw(data=ldap_raw_data, deploy=deploy, sample=sample))
-        click.secho("Data is ready in %s" % ofile, fg='blue')
+    click.secho('Retrieving LDAP raw data', fg='green')
+    if incremental:
+        state = SyncState(os.path.join(os.path.abspath(odir), '.penv-sync-%s' % lab.lower()))
+        state.load()
+        ldap_raw_data, deleted = ldaph.pull_dhcp_changes(state)
+    else:
+        ldap_raw_data = ldaph.pull_dhcp_data(HOSTS_FILTER, HOSTS_ATTRS)
+    # the skeleton pull already brought every subnet
+    subnets = ldaph.subnet_index(skeleton if skeleton else None)
+    if push:
+        push_hosts(ldaph, lab, ldap_raw_data, deploy, sample, subnets, skeleton if skeleton else None,
+                   host, port, workers, batch_size, queue_size, write_files, split, ofile, odir, shard_records, shard_bytes, fmt,
+                   parse_workers)
+    elif split:
+        # shards are written while extracting, no commands.yml to split later
+        writer = ShardWriter(os.path.abspath(odir), deploy, shard_records, shard_bytes, fmt=fmt)
+        ldaph.process_raw(data=ldap_raw_data, deploy=deploy, sample=sample, subnets=subnets, writer=writer,
+                          workers=parse_workers)
+        click.secho("Data is ready in %s shard files, see %s" % (len(writer.shards),
+                    os.path.join(os.path.abspath(odir), writer.manifest)), fg='blue')
+        add(records=writer.count,
+            bytes=sum(os.path.getsize(os.path.join(os.path.abspath(odir), shard['file'])) for shard in writer.shards))
+    else:
+        with open(ofile, 'w') as f:
 
-    if split:
-        with open(ofile, 'r') as f:
-            click.secho('Splitting to smaller files', fg='green')
-            ldaph.split_yml(ofile, 500)
+            ldaph.process_raw(data=ldap_raw_data, deploy=deploy, sample=sample, subnets=subnets, out=f, fmt=fmt,
+                              workers=parse_workers)
+            click.secho("Data is ready in %s" % ofile, fg='blue')
+        add(bytes=os.path.getsize(ofile))
+
+    if incremental:
+        commands = ldaph.deleted_hosts(deleted)
+        deleted_file = os.path.join(os.path.abspath(odir), 'deleted' + EXTENSIONS[fmt])
+        if commands:
+            # only the hosts gone since the previous run, post with dhcpawn populate --filename
+            write_diff(deleted_file, {'create': [], 'delete': commands}, fmt)
+            click.secho("Deletes of %s hosts are in %s" % (len(commands), deleted_file), fg='blue')
+        elif os.path.exists(deleted_file):
+            # the deletes of an earlier run must not be posted again
+            os.remove(deleted_file)
+        # only move the high-water mark once the output is written
+        state.save()
 
     click.secho("End %s" % datetime.datetime.ctime(datetime.datetime.now()), fg='yellow')
+def push_hosts(ldaph, lab, data, deploy, sample, subnets, skeleton, host, port, workers, batch_size, queue_size,
+               write_files, split, ofile, odir, shard_records, shard_bytes, fmt, parse_workers=0):
+    """
+    post the skeleton (sections of extract_skeleton, or None) and the hosts
+    of data to DHCPawn while data is pulled and parsed, and with write_files
+    write the hosts as ldap_to_yml would at the same time
+    """
+    # only dhcpawn commands need requests
+    from .populate import Populator, BatchSizer, HostCoalescer
+    from .stream import HostPusher
+
+    click.secho("Pushing to DHCPawn at %s:%s" % (host, port), fg='yellow')
+    populator = Populator(host, port, workers)
+    coalescer = HostCoalescer(populator, BatchSizer(batch_size, min(batch_size, 10), max(batch_size, 5000)))
+    commands = [cmd for name in SKELETON_SECTIONS for cmd in skeleton[name]] if skeleton else None
+    writers = [HostPusher(populator, coalescer, deploy, commands, lab.lower(), queue_size)]
+    f = None
+    if write_files and split:
+        writers.append(ShardWriter(os.path.abspath(odir), deploy, shard_records, shard_bytes, fmt=fmt))
+    elif write_files:
+        f = open(ofile, 'w')
+        writers.append(HOST_WRITERS[fmt](f, deploy))
+    try:
+        ldaph.process_raw(data=data, deploy=deploy, sample=sample, subnets=subnets, writer=TeeWriter(writers),
+                          workers=parse_workers)
+    finally:
+        if f is not None:
+            f.close()
+        populator.close()
+    add(records=populator.sent)
+    if write_files and split:
+        click.secho("Data is also in %s shard files, see %s" % (len(writers[1].shards),
+                    os.path.join(os.path.abspath(odir), writers[1].manifest)), fg='blue')
+    elif write_files:
+        click.secho("Data is also in %s" % ofile, fg='blue')
+    click.secho("Last batch size %s hosts per request" % coalescer.sizer.current(), fg='yellow')
+    if populator.report():
+        raise click.Abort()
+
 ####### Extract LDAP Skeleton from raw ldap data
 @dhcpldap.command()
 @click.option('--lab', default='infi1', help='Infi1 (default) / telad / gdc /')
@@ -443,7 +708,7 @@ def get_skeleton(ldaph, lab, ofile, deployed):
     skeleton = dict()
     ldaph.connect(lab)
     click.secho('Retrieving LDAP raw data', fg='green')
-    ldap_raw_data = ldaph.pull_dhcp_data()
+    ldap_raw_data = ldaph.pull_dhcp_data(SKELETON_FILTER, SKELETON_ATTRS)
     try:
         skeleton = ldaph.extract_skeleton(rawdata=ldap_raw_data, ofile=ofile)
     except Exception as e:
@@ -497,16 +762,24 @@ def get_skeleton(ldaph, lab, ofile, deployed):
 
 @dhcpldap.command()
 @click.option('--ofile', default=None, help='output file to which ldap data is written')
+@click.option('--json', 'ojson', default=None, help='also write the report as JSON to this file')
 @click.option('--lab', default='infi1', help='Infi1 / telad / gdc /')
 @click.pass_obj
-def sanity_report(ldaph, lab, ofile):
+def sanity_report(ldaph, lab, ofile, ojson):
 
     ldaph.connect(lab)
     click.secho('Retrieving LDAP raw data', fg='green')
-    ldap_raw_data = ldaph.pull_dhcp_data()
+    skeleton_raw_data = ldaph.pull_dhcp_data(SKELETON_FILTER, SKELETON_ATTRS)
+    ldap_raw_data = ldaph.pull_dhcp_data(HOSTS_FILTER, HOSTS_ATTRS)
 
     click.secho('Creating Sanity Report', fg='blue')
-    report_str = ldaph.sanity_report(ldap_raw_data)
+    report = ldaph.sanity_report(ldap_raw_data, skeleton_raw_data)
+    report_str = text_report(report)
+
+    if ojson:
+        with open(ojson, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        click.secho('JSON sanity report availble in %s' % ojson, fg='green')
 
     if ofile:
         with open(ofile, 'w') as f:
@@ -516,106 +789,179 @@ def sanity_report(ldaph, lab, ofile):
         print(report_str)
 
 
+##### ADDRESS SPACE UTILIZATION
+
+@dhcpldap.command()
+@click.option('-l', '--lab', 'labs', multiple=True, help='lab to report on (default infi1), can be repeated')
+@click.option('--json', 'ojson', default=None, help='also write the report as JSON to this file')
+@click.pass_obj
+def utilization(ldaph, labs, ojson):
+    """
+    used, dynamic and free addresses per subnet and lab
+    """
+    labs = ldaph.unique_labs(labs or ['infi1'])
+    skeletons = ldaph.pull_labs(labs, SKELETON_FILTER, SKELETON_ATTRS)
+    hosts = ldaph.pull_labs(labs, HOSTS_FILTER, HOSTS_ATTRS)
+
+    report = dict()
+    columns = ('size', 'dynamic', 'used', 'static', 'free')
+    for lab in labs:
+        records = list(parse_entries(skeletons[lab]))
+        ips = []
+        for rec in parse_entries(hosts[lab]):
+            if isinstance(rec, Host) and rec.ip:
+                try:
+                    ips.append(ip_to_int(rec.ip))
+                except ValueError:
+                    # not an address (a hostname), see sanity_report
+                    pass
+        subnets = subnet_utilization([r for r in records if isinstance(r, Subnet)],
+                                     [r for r in records if isinstance(r, Pool)], ips)
+        total = dict((c, sum(sub[c] for sub in subnets)) for c in columns)
+        report[lab] = {'subnets': subnets, 'total': total}
+
+        click.secho('%s' % lab, fg='green')
+        click.echo('%-18s %-15s %10s %10s %10s %10s %10s %6s' % (('subnet', 'netmask') + columns + ('used%',)))
+        for sub in subnets + [dict(total, subnet='total', netmask='')]:
+            busy = sub['dynamic'] + sub['static']
+            click.echo('%-18s %-15s %10s %10s %10s %10s %10s %5.1f%%' % (
+                sub['subnet'], sub['netmask'], sub['size'], sub['dynamic'], sub['used'], sub['static'], sub['free'],
+                100.0 * busy / sub['size'] if sub['size'] else 0))
+
+    if ojson:
+        with open(ojson, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        click.secho('JSON utilization report availble in %s' % ojson, fg='green')
+
+
 ##### LDAP SEARCH
 
-def search_in_lab(ldaph, lab, st):
+def search_matches(data, st):
+    """
+    the entries holding st (case insensitive) in any of SEARCH_ATTRS.
+    dhcp.schema gives dhcpHWAddress and dhcpStatements no SUBSTR matching
+    rule, a server side *st* filter on them matches nothing, so the server
+    only picks the hosts and the substrings are matched here
+    """
+    st = st.lower().encode('utf-8')
+    return [(dn, attrs) for dn, attrs in data
+            if any(st in value.lower() for attr in SEARCH_ATTRS for value in attrs.get(attr, []))]
 
-    ldaph.connect(lab)
-    click.secho('Retrieving LDAP raw data from %s' % lab, fg='green')
-    data = ldaph.pull_dhcp_data()
+def search_hits(data):
 
     dhcp_dict = dict()
 
-    for e in data:
-        if st in str(e):
-            if 'dhcpHWAddress' in e[1]:
-                mac = e[1]['dhcpHWAddress'][0].split()[1]
-            else:
-                mac = "NA"
+    for dn, attrs in data:
+        if 'cn' not in attrs:
+            continue
+        if 'dhcpHWAddress' in attrs:
+            mac = attrs['dhcpHWAddress'][0].decode('utf-8').split()[1]
+        else:
+            mac = "NA"
 
-            if 'dhcpStatements' in e[1]:
-                ip = e[1]['dhcpStatements'][0].split()[1]
-            else:
-                ip = "NA"
+        if 'dhcpStatements' in attrs:
+            ip = attrs['dhcpStatements'][0].decode('utf-8').split()[1]
+        else:
+            ip = "NA"
 
-            dhcp_dict[e[1]['cn'][0]] = [mac, ip]
+        dhcp_dict[attrs['cn'][0].decode('utf-8')] = [mac, ip]
 
     return dhcp_dict
 
+def print_index_hits(hits, lab=None):
+    for h in hits:
+        print("(%s) %s -> %s" % (lab or h['lab'], h['hostname'], [h['mac'] or "NA", h['ip'] or "NA"]))
+
 @dhcpldap.command()
 @click.option('-l', '--lab', default=None, help='which ldap to search')
+@click.option('--live/--no-live', default=False, help='search LDAP itself instead of the local index')
+@click.option('--index', 'index_path', default=None, help='local index file (default ~/.cache/penv/index.sqlite)')
 @click.argument('st')
 @click.pass_obj
-def ldap_search(ldaph, st, lab):
+def ldap_search(ldaph, st, lab, live, index_path):
+
+    hostindex = HostIndex(index_path)
+    if not live and hostindex.exists():
+        with hostindex:
+            indexed = hostindex.labs()
+            labs = ldaph.aliases(lab) if lab else None
+            if indexed and (not labs or any(l in indexed for l in labs)):
+                built = min(indexed[l][0] for l in (labs or indexed) if l in indexed)
+                click.secho('From the index of %s, use --live to ask LDAP'
+                            % datetime.datetime.ctime(datetime.datetime.fromtimestamp(built)), fg='yellow')
+                print_index_hits(hostindex.search(st, labs), lab)
+                return
+    if not live:
+        click.secho('No index of %s, searching LDAP (see "index build")' % (lab or 'the labs'), fg='yellow')
 
     dhcp_dict = dict()
 
     if lab:
-        # click.secho('Searching for %s in %s' % (str, lab), fg='green' )
-        dhcp_dict[lab] = search_in_lab(ldaph, lab, st )
+        labs = [lab]
     else:
-        for l in ldaph.labs.keys():
-            # click.secho('Searching for %s in %s' % (str, l), fg='green' )
-            dhcp_dict[l] = search_in_lab(ldaph,l, st)
-            if not dhcp_dict[l]:
-                click.secho('nothing found in %s' % l, fg='yellow' )
+        # infi1 and gdc are the same server, only ask it once
+        labs = ldaph.unique_labs(ldaph.labs.keys())
+
+    # only the hosts and the attributes searched come back,
+    # all labs are searched at once
+    click.secho('Searching LDAP of %s' % ', '.join(labs), fg='green')
+    data = ldaph.pull_labs(labs, HOSTS_FILTER, SEARCH_ATTRS, use_cache=False)
+    for l in labs:
+        dhcp_dict[l] = search_hits(search_matches(data[l], st))
+        if not dhcp_dict[l] and not lab:
+            click.secho('nothing found in %s' % l, fg='yellow' )
 
     for l in dhcp_dict:
-        # since infi1 and gdc will give the same data
-        # filter gdc when infi1 is incleded
-        if l=='gdc' and 'infi1' in dhcp_dict and 'gdc' in dhcp_dict:
-            break
         for component in dhcp_dict[l]:
             print("(%s) %s -> %s" % (l, component, dhcp_dict[l][component]))
 
 
-##### POPULATE LDAP INFO YML FILES TO DHCPAWN DB /  LDAP
-def populate_single_file(host, port, filename):
-    if not filename.endswith('yml'):
-        return
-    with open(filename, 'r') as f:
-        click.secho('Loading YML %s' % filename, fg='blue')
-        cmnds = yaml.load(f)
-        click.secho('Finished Loading YML', fg='blue')
-    for command in cmnds:
-        try:
-            url = 'http://%s:%s%s' % (host, port, command['url'])
-            re = requests.post(url, data=json.dumps(command['data']))
-        except Exception as e:
-            click.secho(e, fg='red')
-            raise click.Abort()
+##### LOCAL INDEX OF ALL LABS
 
-        if not re.status_code == 200 or "Registration Failed" in re.text:
-            click.secho("%s : %s" % (re.status_code, re.text), fg='blue')
-
-def populate_batch(host, port, folder, filename):
-    # when batch is used i assume filename is a string
-    # like ymlcmd with which i can find all relelvant yml
-    # files in folder. folder must be used when batch is used.
-    for f in os.listdir(folder):
-        if f.startswith(filename):
-            curfile = folder + "/" + f
-            populate_single_file(host,port,curfile)
-
-@dhcpawn.command()
-@click.option("--host", help="Host running DHCPawn", default="localhost")
-@click.option("--port", help="Port on host running DHCPawn", default=8000)
-@click.option("--filename", default='ymlcmd', help="YAML file containing population calls, like sample_data.yml")
-@click.option('--batch/--no-batch', default=False, help='in case we have several yml files to populate')
-@click.option('--folder', help='if batch used ,give directory where all yml files exist')
-@click.option('--full/--no-full', default=False , help='populate skeleton and all LDAP entries')
-def populate(host, port, filename, batch, folder, full):
-
-    if batch and (not folder or not filename):
-        click.secho("When using batch , you must give folder and filename", fg='red')
-        raise click.Abort()
+def index_labs(ldaph, hostindex, labs):
+    """
+    pull the hosts of labs (all at once) and replace them in the index
+    """
+    click.secho('Retrieving hosts of %s' % ', '.join(labs), fg='green')
+    data = ldaph.pull_labs(labs, HOSTS_FILTER, HOSTS_ATTRS)
+    for l in labs:
+        count = hostindex.store(l, (rec for rec in parse_entries(data[l]) if isinstance(rec, Host)))
+        click.secho('%s hosts of %s indexed' % (count, l), fg='blue')
 
-    if full:
-        populate_single_file(host, port, os.path.abspath(folder) + "/" + 'skeleton.yml')
-        populate_batch(host, port, folder, filename)
-    elif batch:
-        click.secho("Populating to %s:%s" % (host,port), fg='yellow')
-        populate_batch(host, port, folder, filename)
-    else:
-        click.secho("Populating to %s:%s" % (host,port), fg='yellow')
-        populate_single_file(host, port, filename)
+@dhcpldap.group()
+@click.option('--index', 'index_path', default=None, help='local index file (default ~/.cache/penv/index.sqlite)')
+@click.pass_context
+def index(ctx, index_path):
+    """
+    local index of the hosts of all labs, used by ldap_search
+    """
+    ctx.meta['penv.index'] = HostIndex(index_path)
+
+@index.command()
+@click.option('-l', '--lab', 'labs', multiple=True, help='lab to index (default all of them)')
+@click.pass_context
+def build(ctx, labs):
+    """
+    build the index from scratch
+    """
+    ldaph = ctx.obj
+    hostindex = ctx.meta['penv.index']
+    labs = ldaph.unique_labs(labs or ldaph.labs.keys())
+    if hostindex.exists():
+        os.remove(hostindex.path)
+    with hostindex:
+        index_labs(ldaph, hostindex, labs)
+    click.secho('Index is ready in %s' % hostindex.path, fg='green')
+
+@index.command()
+@click.option('-l', '--lab', 'labs', multiple=True, help='lab to refresh (default the indexed ones)')
+@click.pass_context
+def refresh(ctx, labs):
+    """
+    pull the labs again and replace them in the index
+    """
+    ldaph = ctx.obj
+    hostindex = ctx.meta['penv.index']
+    with hostindex:
+        labs = ldaph.unique_labs(labs or sorted(hostindex.labs()) or ldaph.labs.keys())
+        index_labs(ldaph, hostindex, labs)
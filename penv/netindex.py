@@ -0,0 +1,107 @@
+"""
+integer based lookups of IPv4 addresses in subnets.
+"""
+from bisect import bisect_right
+from ipaddress import IPv4Network
+
+
+def ip_to_int(ip):
+    """
+    dotted quad string -> int, much cheaper than building an IPv4Address
+    """
+    a, b, c, d = ip.split('.')
+    a, b, c, d = int(a), int(b), int(c), int(d)
+    if not (0 <= a < 256 and 0 <= b < 256 and 0 <= c < 256 and 0 <= d < 256):
+        raise ValueError("%s is not a valid IPv4 address" % ip)
+    return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def int_to_ip(n):
+    return '%d.%d.%d.%d' % (n >> 24, (n >> 16) & 255, (n >> 8) & 255, n & 255)
+
+
+def network_range(name, netmask):
+    """
+    (first, last) address of a subnet as ints
+    """
+    net = IPv4Network("%s/%s" % (name, netmask))
+    return int(net.network_address), int(net.broadcast_address)
+
+
+class SubnetIndex(object):
+    """
+    maps IPs to the name of the most specific (longest prefix) subnet
+    holding them.
+    CIDR networks are either nested or disjoint, so they are flattened once
+    into a sorted list of non overlapping segments, each owned by the
+    innermost network covering it. a lookup is then a single bisect.
+    """
+
+    def __init__(self, networks=()):
+        """
+        networks - iterable of (name, first, last) with first/last as ints
+        """
+        self._starts = []
+        self._names = []
+        self._count = 0
+        # outer networks first, nested ones right after their parent
+        ordered = sorted(networks, key=lambda n: (n[1], -n[2]))
+        stack = []
+        for name, first, last in ordered:
+            self._count += 1
+            while stack and stack[-1][1] < first:
+                self._close(stack)
+            self._segment(first, name)
+            stack.append((name, last))
+        while stack:
+            self._close(stack)
+
+    @classmethod
+    def from_subnets(cls, subnets):
+        """
+        build the index out of Subnet records
+        """
+        return cls((s.name,) + network_range(s.name, s.netmask) for s in subnets)
+
+    def _segment(self, start, name):
+        if self._starts and self._starts[-1] == start:
+            self._names[-1] = name
+        else:
+            self._starts.append(start)
+            self._names.append(name)
+
+    def _close(self, stack):
+        name, last = stack.pop()
+        # back to the enclosing network, or to a gap
+        self._segment(last + 1, stack[-1][0] if stack else None)
+
+    def __len__(self):
+        return self._count
+
+    def lookup(self, ip):
+        """
+        subnet name of ip (dotted string or int), None if no subnet holds it
+        """
+        if not isinstance(ip, int):
+            ip = ip_to_int(str(ip))
+        i = bisect_right(self._starts, ip) - 1
+        if i < 0:
+            return None
+        return self._names[i]
+
+    def lookup_many(self, ips):
+        """
+        subnet names of many IPs at once, in the same order as ips.
+        the IPs are sorted and matched against the segments in one sweep.
+        """
+        ints = [ip if isinstance(ip, int) else ip_to_int(str(ip)) for ip in ips]
+        result = [None] * len(ints)
+        starts = self._starts
+        i = -1
+        for pos in sorted(range(len(ints)), key=ints.__getitem__):
+            ip = ints[pos]
+            while i + 1 < len(starts) and starts[i + 1] <= ip:
+                i += 1
+            if i >= 0:
+                result[pos] = self._names[i]
+        return result
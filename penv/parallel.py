@@ -0,0 +1,110 @@
+"""
+parsing of raw LDAP entries on all cores.
+entries are cut into chunks that a pool of processes parses, the results
+come back in the order of the chunks, so whatever is merged from them in
+the calling process (first host of a mac wins, ...) comes out exactly as
+it would parsing serially. only a few chunks per worker are out at a
+time, a paged pull is read as the pool frees up.
+"""
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .records import Host, parse_entry
+
+CHUNK_SIZE = 2000
+
+# SubnetIndex of the lab, set in every worker by _init
+_subnets = None
+
+
+def _init(subnets):
+    global _subnets
+    _subnets = subnets
+
+
+def parse_chunk(chunk):
+    """
+    records of a chunk of raw entries, as parse_entries yields them
+    """
+    records = []
+    for e in chunk:
+        rec = parse_entry(e)
+        if rec is not None:
+            records.append(rec)
+    return records
+
+
+def host_chunk(chunk):
+    """
+    (hostname, mac, group, ip, subnet) of every host with a mac in a chunk
+    of raw entries, the subnet looked up in the index given to the pool
+    """
+    hosts = []
+    for e in chunk:
+        rec = parse_entry(e)
+        if not isinstance(rec, Host) or rec.mac is None:
+            continue
+        subnet = None
+        if rec.ip and _subnets is not None:
+            try:
+                subnet = _subnets.lookup(rec.ip)
+            except ValueError:
+                # same as Ldap.iter_hosts, a hostname fixed-address has no subnet
+                subnet = None
+        hosts.append((rec.hostname, rec.mac, rec.group, rec.ip, subnet))
+    return hosts
+
+
+def _mp_context():
+    """
+    workers are started from a fresh server process (a spawned one where
+    there is none), never forked off this one: the shard writer, pusher
+    and populator threads are running by the time the pool starts, a fork
+    could copy their locks held and hang the workers
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def chunked(entries, size=CHUNK_SIZE):
+    chunk = []
+    for e in entries:
+        chunk.append(e)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_chunks(func, entries, workers=None, chunk_size=CHUNK_SIZE, subnets=None):
+    """
+    yield func(chunk) for consecutive chunks of entries, computed on
+    `workers` processes (default all cores), in the order of the chunks.
+    subnets - SubnetIndex host_chunk looks subnets up in
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(), initializer=_init, initargs=(subnets,))
+    pending = deque()
+    try:
+        for chunk in chunked(entries, chunk_size):
+            pending.append(pool.submit(func, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # a consumer stopping early (--sample) leaves chunks nobody waits for
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def parse_entries_parallel(entries, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    parse_entries on a process pool, same records in the same order
+    """
+    for records in map_chunks(parse_chunk, entries, workers, chunk_size):
+        for rec in records:
+            yield rec
@@ -0,0 +1,319 @@
+"""
+concurrent engine posting DHCPawn commands.
+one pooled keep-alive session is shared by a pool of worker threads,
+the number of commands in flight is bounded so commands can be read
+lazily from their files while earlier ones are being posted.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+
+from .formats import MULTIPLE_URL
+
+# statuses worth another try
+RETRY_STATUSES = (500, 502, 503, 504)
+JOURNAL_NAME = 'populate.journal'
+
+
+class Journal(object):
+    """
+    append only checkpoint log of a populate run, one JSON line per
+    posted command ({"file", "index", "ok", "status"}), and a "complete"
+    line for every file all of whose commands went through.
+    with resume, the log of the previous run is replayed so done commands
+    (and whole complete files) can be skipped.
+    index is the position of the command in its file, or for hosts that
+    are coalesced across files, the key of the host record (h123).
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        self.complete = set()
+        # file -> indexes of the commands it holds
+        self.files = dict()
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash
+                        continue
+                    if rec.get('complete'):
+                        self.complete.add(rec['file'])
+                    elif rec.get('ok'):
+                        self.done.add((rec['file'], rec['index']))
+            self.fh = open(path, 'a')
+        else:
+            self.fh = open(path, 'w')
+
+    def key(self, source):
+        return os.path.basename(source) if source else source
+
+    def is_complete(self, source):
+        return self.key(source) in self.complete
+
+    def is_done(self, source, index):
+        return (self.key(source), index) in self.done
+
+    def expect(self, source, indexes):
+        """
+        source holds the commands (or host records) of these indexes
+        """
+        with self.lock:
+            self.files[self.key(source)] = list(indexes)
+
+    def _write(self, rec):
+        self.fh.write(json.dumps(rec) + "\n")
+        self.fh.flush()
+
+    def record(self, source, index, ok, status):
+        with self.lock:
+            if ok:
+                self.done.add((self.key(source), index))
+            self._write({'file': self.key(source), 'index': index, 'ok': ok, 'status': status})
+
+    def close(self):
+        """
+        mark the files all of whose commands are done, and close the log
+        """
+        with self.lock:
+            for source, indexes in sorted(self.files.items()):
+                if source in self.complete:
+                    continue
+                if all((source, i) in self.done for i in indexes):
+                    self.complete.add(source)
+                    self._write({'file': source, 'complete': True, 'commands': len(indexes)})
+            self.fh.close()
+
+    def pending(self):
+        return sum(1 for source, indexes in self.files.items() if source not in self.complete
+                   for i in indexes if (source, i) not in self.done)
+
+
+class BatchSizer(object):
+    """
+    tunes the number of records per coalesced request while populating
+    (additive increase, multiplicative decrease):
+    every fast and successful request grows the batch by `step` records,
+    a slow one (over target_latency seconds) shrinks it by a quarter and
+    a failed one halves it.
+    """
+
+    def __init__(self, size=500, min_size=10, max_size=5000, target_latency=5.0, step=None):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.step = step or max(1, size // 10)
+        self.lock = threading.Lock()
+
+    def current(self):
+        with self.lock:
+            return self.size
+
+    def observe(self, records, seconds, ok):
+        with self.lock:
+            if not ok:
+                self.size = max(self.min_size, self.size // 2)
+            elif seconds > self.target_latency:
+                self.size = max(self.min_size, int(self.size * 0.75))
+            elif records >= self.size:
+                # only a full batch tells us the size itself was fine
+                self.size = min(self.max_size, self.size + self.step)
+
+
+class HostCoalescer(object):
+    """
+    gathers host records of /rest/multiple/ commands from any number of
+    files and posts them in /rest/multiple/ requests sized by a BatchSizer.
+    only hosts are coalesced: /rest/multiple/ is the one batch endpoint
+    of DHCPawn we know, it is only ever used for hosts, and the skeleton
+    endpoints take a single record per request. skeleton commands are
+    posted one by one (in parallel along their dependencies, schedule.py).
+    """
+
+    def __init__(self, populator, sizer):
+        self.populator = populator
+        self.sizer = sizer
+        # deploy value -> [(source, key, record)]
+        self.pending = dict()
+
+    def add(self, source, key, record, deploy):
+        batch = self.pending.setdefault(deploy, [])
+        batch.append((source, key, record))
+        if len(batch) >= self.sizer.current():
+            self.flush(deploy)
+
+    def flush(self, deploy):
+        batch = self.pending.pop(deploy, None)
+        if not batch:
+            return
+        data = {'deploy': deploy}
+        # keys of the request's own, two files can use the same h<n>,
+        # the (file, key) pairs are only for the journal
+        for n, (source, key, record) in enumerate(batch):
+            data['h%s' % n] = record
+        command = {'url': MULTIPLE_URL, 'data': data}
+        units = [(source, key) for source, key, record in batch]
+        label = batch[0][0] if len(set(u[0] for u in units)) == 1 else '%s files' % len(set(u[0] for u in units))
+        records = len(batch)
+        self.populator.submit(command, label, '%s..%s' % (batch[0][1], batch[-1][1]), units,
+                              lambda ok, seconds: self.sizer.observe(records, seconds, ok))
+
+    def flush_all(self):
+        for deploy in list(self.pending):
+            self.flush(deploy)
+
+
+class Populator(object):
+
+    def __init__(self, host, port, workers=8, inflight=None, retries=3, backoff=0.5, timeout=120, journal=None):
+        self.base_url = 'http://%s:%s' % (host, port)
+        self.journal = journal
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.inflight = inflight or workers * 2
+        self.slots = threading.BoundedSemaphore(self.inflight)
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.latencies = []
+        self.failures = []
+
+    def post(self, command):
+        """
+        post a single command, retrying with exponential backoff on
+        connection errors and 5xx answers. commands holding a 'method'
+        (PUT, DELETE) are sent with it instead of POST.
+        return (ok, status, text), status is None when no answer came back
+        """
+        url = self.base_url + command['url']
+        body = json.dumps(command['data'])
+        method = command.get('method', 'POST')
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                re = self.session.request(method, url, data=body, timeout=self.timeout)
+                status, text = re.status_code, re.text
+            except RequestException as e:
+                status, text = None, str(e)
+            with self.lock:
+                self.latencies.append(time.time() - start)
+            if (status is None or status in RETRY_STATUSES) and attempt < self.retries:
+                attempt += 1
+                with self.lock:
+                    self.retried += 1
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+                continue
+            ok = status == 200 and "Registration Failed" not in text
+            with self.lock:
+                self.sent += 1
+            return ok, status, text
+
+    def _run(self, command, source, index, units, on_done):
+        start = time.time()
+        try:
+            ok, status, text = self.post(command)
+        except Exception as e:
+            ok, status, text = False, None, repr(e)
+        try:
+            if self.journal:
+                for unit_source, unit_index in units:
+                    self.journal.record(unit_source, unit_index, ok, status)
+            if not ok:
+                self.fail(command, source, index, status, text)
+            if on_done:
+                on_done(ok, time.time() - start)
+            return ok, status, text
+        finally:
+            self.slots.release()
+
+    def fail(self, command, source, index, status, text):
+        with self.lock:
+            self.failures.append({'file': source, 'index': index, 'url': command['url'],
+                                  'status': status, 'error': text})
+
+    def submit(self, command, source=None, index=None, units=None, on_done=None):
+        """
+        queue a command, blocks while too many commands are in flight.
+        units - (file, index) pairs the command carries, for the journal.
+        by default the command is the single unit (source, index).
+        on_done - called with (ok, seconds) once the command was posted
+        return a future of (ok, status, text)
+        """
+        if units is None:
+            units = [(source, index)]
+        self.slots.acquire()
+        return self.executor.submit(self._run, command, source, index, units, on_done)
+
+    def drain(self):
+        """
+        wait until every command submitted so far was posted
+        """
+        for _ in range(self.inflight):
+            self.slots.acquire()
+        for _ in range(self.inflight):
+            self.slots.release()
+
+    def fetch(self, url):
+        """
+        GET url, return the decoded JSON answer
+        """
+        re = self.session.get(self.base_url + url, timeout=self.timeout)
+        re.raise_for_status()
+        return re.json()
+
+    def run(self, command, source=None, index=None):
+        """
+        post a command and wait for it
+        """
+        return self.submit(command, source, index).result()
+
+    def skip(self, source, index):
+        """
+        True when the journal says the command already went through
+        """
+        return self.journal is not None and self.journal.is_done(source, index)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        if self.journal:
+            self.journal.close()
+
+    def stats(self):
+        """
+        counters of the run, latencies are the seconds of every attempt
+        """
+        with self.lock:
+            return {'sent': self.sent, 'retried': self.retried, 'failed': len(self.failures),
+                    'latencies': list(self.latencies)}
+
+    def report(self):
+        """
+        print what was sent and every failure, return the number of failures
+        """
+        for f in self.failures:
+            click.secho("%s #%s %s -> %s : %s" % (f['file'], f['index'], f['url'], f['status'],
+                                                  (f['error'] or '')[:300]), fg='red')
+        click.secho("%s commands sent, %s retries, %s failed" % (self.sent, self.retried, len(self.failures)),
+                    fg='red' if self.failures else 'green')
+        return len(self.failures)
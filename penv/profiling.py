@@ -0,0 +1,198 @@
+"""
+per stage metrics of a CLI run (p --profile ...).
+code marks its stages with the stage() context manager, the profiled()
+decorator or iterate() for generators (only the time spent producing
+items counts). for every stage the wall and cpu time, the records and
+bytes it reported with add(), and the tracemalloc peak (memory allocated
+on top of what was there when the stage started) are kept.
+stages nest, a stage includes the stages it runs.
+when profiling is off all of these cost next to nothing, and cProfile /
+tracemalloc aren't even imported.
+"""
+import sys
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+
+class Stage(object):
+    __slots__ = ('name', 'wall', 'cpu', 'records', 'bytes', 'peak', 'calls', '_start_mem', '_max_mem')
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.records = 0
+        self.bytes = 0
+        self.peak = None
+        self.calls = 0
+
+    def as_dict(self):
+        return {'name': self.name, 'wall': round(self.wall, 6), 'cpu': round(self.cpu, 6),
+                'records': self.records, 'bytes': self.bytes, 'peak': self.peak, 'calls': self.calls}
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = []
+        self._stack = []
+        self._iterated = dict()
+        self.cprofile_stage = None
+        self._cprofile = None
+
+    def enable(self, cprofile_stage=None):
+        import cProfile
+        import tracemalloc
+        self.enabled = True
+        self.cprofile_stage = cprofile_stage
+        if cprofile_stage:
+            self._cprofile = cProfile.Profile()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def add(self, records=0, bytes=0):
+        """
+        count records / bytes in the innermost running stage
+        """
+        if self.enabled and self._stack:
+            self._stack[-1].records += records
+            self._stack[-1].bytes += bytes
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield None
+            return
+        import tracemalloc
+        st = Stage(name)
+        st.calls = 1
+        current = tracemalloc.get_traced_memory()
+        if self._stack:
+            # the running stage keeps the peak it reached so far
+            parent = self._stack[-1]
+            parent._max_mem = max(parent._max_mem, current[1])
+        tracemalloc.reset_peak()
+        st._start_mem = current[0]
+        st._max_mem = current[0]
+        self._stack.append(st)
+        profile = self._cprofile if name == self.cprofile_stage else None
+        if profile:
+            profile.enable()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield st
+        finally:
+            st.wall = time.perf_counter() - wall
+            st.cpu = time.process_time() - cpu
+            if profile:
+                profile.disable()
+            self._stack.pop()
+            top = max(st._max_mem, tracemalloc.get_traced_memory()[1])
+            st.peak = top - st._start_mem
+            if self._stack:
+                parent = self._stack[-1]
+                parent._max_mem = max(parent._max_mem, top)
+            tracemalloc.reset_peak()
+            self.stages.append(st)
+
+    def profiled(self, name):
+        """
+        decorator running a function as a stage
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def iterate(self, name, iterable):
+        """
+        yield from iterable, timing only the production of the items
+        (a lazy LDAP pull is consumed inside the stages that process it)
+        """
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iterable)
+
+    def _iterate(self, name, iterable):
+        st = self._iterated.get(name)
+        if st is None:
+            st = self._iterated[name] = Stage(name)
+            self.stages.append(st)
+        st.calls += 1
+        it = iter(iterable)
+        profile = self._cprofile if name == self.cprofile_stage else None
+        while True:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            if profile:
+                profile.enable()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                if profile:
+                    profile.disable()
+                st.wall += time.perf_counter() - wall
+                st.cpu += time.process_time() - cpu
+            st.records += 1
+            yield item
+
+    def summary(self):
+        """
+        the stages aggregated by name, in the order they first started
+        """
+        totals = dict()
+        order = []
+        for st in self.stages:
+            if st.name not in totals:
+                totals[st.name] = Stage(st.name)
+                order.append(st.name)
+            t = totals[st.name]
+            t.wall += st.wall
+            t.cpu += st.cpu
+            t.records += st.records
+            t.bytes += st.bytes
+            t.calls += st.calls
+            if st.peak is not None:
+                t.peak = max(t.peak or 0, st.peak)
+        return [totals[name] for name in order]
+
+    def report(self, ojson, cprofile_out=None, out=sys.stderr):
+        """
+        write the metrics to ojson, the cProfile stats to cprofile_out
+        and print the summary table
+        """
+        if not self.enabled:
+            return
+        import tracemalloc
+        summary = self.summary()
+        with open(ojson, 'w') as f:
+            json.dump({'stages': [st.as_dict() for st in self.stages],
+                       'summary': [st.as_dict() for st in summary],
+                       'tracemalloc_peak': tracemalloc.get_traced_memory()[1]}, f, indent=2)
+        out.write('%-22s %6s %10s %10s %10s %12s %12s\n' % ('stage', 'calls', 'wall', 'cpu', 'records', 'bytes', 'peak'))
+        for st in summary:
+            out.write('%-22s %6s %10.3f %10.3f %10s %12s %12s\n' % (
+                st.name, st.calls, st.wall, st.cpu, st.records, st.bytes, '-' if st.peak is None else st.peak))
+        out.write('metrics written to %s\n' % ojson)
+        if self._cprofile is not None:
+            cprofile_out = cprofile_out or '%s.prof' % self.cprofile_stage
+            self._cprofile.dump_stats(cprofile_out)
+            out.write('cProfile stats of %s written to %s\n' % (self.cprofile_stage, cprofile_out))
+
+
+profiler = Profiler()
+stage = profiler.stage
+profiled = profiler.profiled
+iterate = profiler.iterate
+add = profiler.add
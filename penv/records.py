@@ -0,0 +1,116 @@
+"""
+typed records of the DHCP objects we read from LDAP.
+every raw (dn, attrs) entry is classified and decoded once by
+parse_entry, the skeleton and host writers only work on these records.
+"""
+
+
+def _first(attrs, name):
+    values = attrs.get(name)
+    if not values:
+        return None
+    return values[0].decode('utf-8')
+
+
+class Group(object):
+    __slots__ = ('dn', 'name')
+
+    def __init__(self, dn, name):
+        self.dn = dn
+        self.name = name
+
+
+class Subnet(object):
+    __slots__ = ('dn', 'name', 'netmask', 'comments', 'routers', 'ddns_domainname')
+
+    def __init__(self, dn, name, netmask, comments='', routers='', ddns_domainname=''):
+        self.dn = dn
+        self.name = name
+        self.netmask = netmask
+        self.comments = comments
+        self.routers = routers
+        self.ddns_domainname = ddns_domainname
+
+
+class Pool(object):
+    __slots__ = ('dn', 'name', 'subnet_name', 'range_min', 'range_max')
+
+    def __init__(self, dn, name, subnet_name, range_min, range_max):
+        self.dn = dn
+        self.name = name
+        self.subnet_name = subnet_name
+        self.range_min = range_min
+        self.range_max = range_max
+
+
+class Host(object):
+    __slots__ = ('dn', 'hostname', 'group', 'mac', 'ip')
+
+    def __init__(self, dn, hostname, group, mac=None, ip=None):
+        self.dn = dn
+        self.hostname = hostname
+        self.group = group
+        self.mac = mac
+        self.ip = ip
+
+
+def parse_subnet(dn, attrs):
+    routers = ''
+    ddns_domainname = ''
+    for item in attrs.get('dhcpOption', []):
+        item = item.decode('utf-8')
+        if item.startswith('routers'):
+            # taking only the default gateway ip , excluding the "routers" word.
+            routers = ','.join(item.replace(",", "").split(" ")[1:])
+    for item in attrs.get('dhcpStatements', []):
+        item = item.decode('utf-8')
+        if item.startswith('ddns-domainname'):
+            ddns_domainname = item.split()[1].replace("\"", "")
+    return Subnet(dn, _first(attrs, 'cn'), _first(attrs, 'dhcpNetMask'),
+                  _first(attrs, 'dhcpComments') or '', routers, ddns_domainname)
+
+
+def parse_pool(dn, attrs):
+    dhcprange = _first(attrs, 'dhcpRange').split()
+    subnet_name = dn.replace(",", "").split("cn=")[2]
+    return Pool(dn, _first(attrs, 'cn'), subnet_name, dhcprange[0], dhcprange[1])
+
+
+def parse_host(dn, attrs):
+    group = dn.split(',')[1].split('=')[1]
+    mac = _first(attrs, 'dhcpHWAddress')
+    if mac is not None:
+        mac = mac.split()[1]
+    ip = _first(attrs, 'dhcpStatements')
+    if ip is not None:
+        ip = ip.split()[1]
+    return Host(dn, _first(attrs, 'cn'), group, mac, ip)
+
+
+def parse_entry(entry):
+    """
+    classify a raw LDAP entry and return its record,
+    None for entries that are none of host/subnet/pool/group
+    """
+    dn, attrs = entry
+    objclasses = set(el.decode('utf-8') for el in attrs.get('objectClass', []))
+    # same precedence the skeleton extraction always used
+    if 'dhcpHost' in objclasses:
+        return parse_host(dn, attrs)
+    if 'dhcpGroup' in objclasses:
+        return Group(dn, _first(attrs, 'cn'))
+    if 'dhcpSubnet' in objclasses:
+        return parse_subnet(dn, attrs)
+    if 'dhcpPool' in objclasses:
+        return parse_pool(dn, attrs)
+    return None
+
+
+def parse_entries(entries):
+    """
+    generator of records out of raw LDAP entries, one pass
+    """
+    for e in entries:
+        rec = parse_entry(e)
+        if rec is not None:
+            yield rec
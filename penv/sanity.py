@@ -0,0 +1,174 @@
+"""
+consistency checks of the DHCP data of a lab.
+records (records.py) are read once, IPs and macs are kept as ints and
+every check is a sort or a sweep over sorted intervals, so the checks
+stay O(n log n) for millions of hosts:
+
+duplicate_ips - addresses given to more than one host
+duplicate_macs - macs of more than one host
+outside_subnets - host addresses no subnet holds
+static_in_pools - host addresses inside the dynamic range of a pool
+overlapping_pools / overlapping_subnets - ranges sharing addresses
+invalid - hosts / subnets / pools whose address, mac or range can't be parsed
+"""
+import heapq
+
+from .records import Host, Subnet, Pool
+from .netindex import ip_to_int, int_to_ip, network_range, SubnetIndex
+
+CHECKS = ('duplicate_ips', 'duplicate_macs', 'outside_subnets', 'static_in_pools',
+          'overlapping_pools', 'overlapping_subnets', 'invalid')
+
+
+def mac_to_int(mac):
+    digits = mac.replace(':', '').replace('-', '')
+    if len(digits) != 12:
+        raise ValueError("%s is not a valid mac" % mac)
+    return int(digits, 16)
+
+
+def int_to_mac(n):
+    return ':'.join('%02x' % (n >> shift & 255) for shift in range(40, -8, -8))
+
+
+def _duplicates(keys, names):
+    """
+    (key, [names]) of every key appearing more than once, sorted by key
+    """
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    dups = []
+    i = 0
+    while i < len(order):
+        j = i + 1
+        while j < len(order) and keys[order[j]] == keys[order[i]]:
+            j += 1
+        if j - i > 1:
+            dups.append((keys[order[i]], [names[k] for k in sorted(order[i:j])]))
+        i = j
+    return dups
+
+
+def _overlaps(ranges):
+    """
+    (name, other, first, last) for every range starting inside an earlier
+    one (other is the one of them reaching furthest), and the shared addresses
+    """
+    overlaps = []
+    furthest = None
+    for name, first, last in sorted(ranges, key=lambda r: (r[1], -r[2])):
+        if furthest is not None and first <= furthest[2]:
+            overlaps.append((name, furthest[0], first, min(last, furthest[2])))
+        if furthest is None or last > furthest[2]:
+            furthest = (name, first, last)
+    return overlaps
+
+
+class SanityChecker(object):
+
+    def __init__(self):
+        self.hostnames = []
+        self.ip_hosts = []
+        self.ips = []
+        self.mac_hosts = []
+        self.macs = []
+        self.subnets = []
+        self.pools = []
+        self.invalid = []
+
+    def add(self, rec):
+        if isinstance(rec, Host):
+            self.hostnames.append(rec.hostname)
+            if rec.ip:
+                try:
+                    self.ips.append(ip_to_int(rec.ip))
+                    self.ip_hosts.append(rec.hostname)
+                except ValueError:
+                    self.invalid.append({'host': rec.hostname, 'ip': rec.ip})
+            if rec.mac:
+                try:
+                    self.macs.append(mac_to_int(rec.mac))
+                    self.mac_hosts.append(rec.hostname)
+                except ValueError:
+                    self.invalid.append({'host': rec.hostname, 'mac': rec.mac})
+        elif isinstance(rec, Subnet):
+            try:
+                self.subnets.append((rec.name,) + network_range(rec.name, rec.netmask))
+            except ValueError:
+                self.invalid.append({'subnet': rec.name, 'netmask': rec.netmask})
+        elif isinstance(rec, Pool):
+            try:
+                self.pools.append((rec.name, ip_to_int(rec.range_min), ip_to_int(rec.range_max)))
+            except ValueError:
+                self.invalid.append({'pool': rec.name, 'range': '%s %s' % (rec.range_min, rec.range_max)})
+
+    def add_all(self, records):
+        for rec in records:
+            self.add(rec)
+        return self
+
+    def static_in_pools(self):
+        """
+        sweep of the sorted host addresses over the pools sorted by start,
+        the pools covering the current address are kept in a heap by end
+        """
+        found = []
+        pools = sorted(self.pools, key=lambda p: p[1])
+        active = []
+        p = 0
+        for k in sorted(range(len(self.ips)), key=self.ips.__getitem__):
+            ip = self.ips[k]
+            while p < len(pools) and pools[p][1] <= ip:
+                heapq.heappush(active, (pools[p][2], pools[p][0]))
+                p += 1
+            while active and active[0][0] < ip:
+                heapq.heappop(active)
+            for last, name in sorted(a for a in active if a[0] >= ip):
+                found.append({'host': self.ip_hosts[k], 'ip': int_to_ip(ip), 'pool': name})
+        return found
+
+    def check(self):
+        """
+        run all checks, return the structured report
+        """
+        index = SubnetIndex(self.subnets)
+        outside = [{'host': self.ip_hosts[k], 'ip': int_to_ip(self.ips[k])}
+                   for k, name in enumerate(index.lookup_many(self.ips)) if name is None]
+        report = {
+            'duplicate_ips': [{'ip': int_to_ip(ip), 'hosts': hosts} for ip, hosts in _duplicates(self.ips, self.ip_hosts)],
+            'duplicate_macs': [{'mac': int_to_mac(mac), 'hosts': hosts}
+                               for mac, hosts in _duplicates(self.macs, self.mac_hosts)],
+            'outside_subnets': outside if self.subnets else [],
+            'static_in_pools': self.static_in_pools(),
+            'overlapping_pools': [{'pool': name, 'other': other, 'first': int_to_ip(first), 'last': int_to_ip(last)}
+                                  for name, other, first, last in _overlaps(self.pools)],
+            'overlapping_subnets': [{'subnet': name, 'other': other, 'first': int_to_ip(first), 'last': int_to_ip(last)}
+                                    for name, other, first, last in _overlaps(self.subnets)],
+            'invalid': self.invalid,
+        }
+        report['summary'] = dict([('hosts', len(self.hostnames)), ('subnets', len(self.subnets)),
+                                  ('pools', len(self.pools))] + [(c, len(report[c])) for c in CHECKS])
+        return report
+
+
+def text_report(report):
+    """
+    the report as text, the IP / MAC duplicates in the format sanity_report always used
+    """
+    lines = ["IP DUPS\n"]
+    lines += ['%s, %s \n' % (d['ip'], d['hosts']) for d in report['duplicate_ips']]
+    lines.append('MAC DUPS\n')
+    lines += ['%s, %s \n' % (d['mac'], d['hosts']) for d in report['duplicate_macs']]
+    lines.append('OUTSIDE SUBNETS\n')
+    lines += ['%s, %s \n' % (d['ip'], d['host']) for d in report['outside_subnets']]
+    lines.append('STATIC IN POOLS\n')
+    lines += ['%s, %s, %s \n' % (d['ip'], d['host'], d['pool']) for d in report['static_in_pools']]
+    lines.append('OVERLAPPING POOLS\n')
+    lines += ['%s, %s, %s-%s \n' % (d['pool'], d['other'], d['first'], d['last']) for d in report['overlapping_pools']]
+    lines.append('OVERLAPPING SUBNETS\n')
+    lines += ['%s, %s, %s-%s \n' % (d['subnet'], d['other'], d['first'], d['last'])
+              for d in report['overlapping_subnets']]
+    lines.append('INVALID\n')
+    lines += ['%s, %s \n' % (d.get('host') or d.get('pool') or d.get('subnet'),
+                             d.get('ip') or d.get('mac') or d.get('range') or d.get('netmask'))
+              for d in report['invalid']]
+    return ''.join(lines)
@@ -0,0 +1,115 @@
+"""
+dependency aware posting of skeleton commands.
+subnets come before their pools and calcranges, pools before their
+dhcpranges. every command is posted as soon as all the commands it
+depends on were posted successfully, everything else runs in parallel.
+"""
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import click
+
+
+def provides(command):
+    """
+    key of the object a command creates, None if nothing depends on it
+    """
+    url = command['url']
+    data = command['data']
+    if url == '/rest/subnets/':
+        return 'subnet:%s' % data['name']
+    if url == '/rest/pools/':
+        return 'pool:%s' % data['name']
+    if url == '/rest/groups/':
+        return 'group:%s' % data['name']
+    return None
+
+
+def requires(command):
+    """
+    keys of the objects a command needs
+    """
+    url = command['url']
+    data = command['data']
+    if url in ('/rest/pools/', '/rest/calcranges/'):
+        return ['subnet:%s' % data['subnet_name']]
+    if url == '/rest/dhcpranges/':
+        return ['pool:%s' % data['pool_name']]
+    return []
+
+
+KNOWN_URLS = ('/rest/subnets/', '/rest/pools/', '/rest/groups/', '/rest/dhcpranges/', '/rest/calcranges/')
+
+
+class SkeletonScheduler(object):
+
+    def __init__(self, populator):
+        self.populator = populator
+        self.commands = []
+
+    def add(self, command, source=None, index=None):
+        self.commands.append((command, source, index))
+
+    def graph(self):
+        """
+        return (number of unmet dependencies, dependents) per command index.
+        a dependency nobody in the skeleton provides is assumed to exist in
+        DHCPawn already. commands of unknown urls wait for all known ones.
+        """
+        providers = dict()
+        for i, (command, source, index) in enumerate(self.commands):
+            key = provides(command)
+            if key:
+                providers.setdefault(key, []).append(i)
+
+        known = [i for i, c in enumerate(self.commands) if c[0]['url'] in KNOWN_URLS]
+        unmet = [0] * len(self.commands)
+        dependents = [[] for c in self.commands]
+        for i, (command, source, index) in enumerate(self.commands):
+            if command['url'] in KNOWN_URLS:
+                deps = set()
+                for key in requires(command):
+                    deps.update(providers.get(key, []))
+            else:
+                deps = set(known)
+            for d in deps:
+                dependents[d].append(i)
+            unmet[i] = len(deps)
+        return unmet, dependents
+
+    def _skip(self, i, dependents, reason, skipped):
+        command, source, index = self.commands[i]
+        if i in skipped:
+            return
+        skipped.add(i)
+        self.populator.fail(command, source, index, None, reason)
+        for d in dependents[i]:
+            self._skip(d, dependents, reason, skipped)
+
+    def run(self):
+        """
+        post all commands, return when every one of them was posted or skipped
+        """
+        unmet, dependents = self.graph()
+        ready = deque(i for i, n in enumerate(unmet) if n == 0)
+        pending = dict()
+        skipped = set()
+        while ready or pending:
+            while ready:
+                i = ready.popleft()
+                command, source, index = self.commands[i]
+                pending[self.populator.submit(command, source, index)] = i
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                ok = future.result()[0]
+                for d in dependents[i]:
+                    if not ok:
+                        reason = 'skipped, depends on %s which failed' % (provides(self.commands[i][0]) or self.commands[i][0]['url'])
+                        self._skip(d, dependents, reason, skipped)
+                    elif d not in skipped:
+                        unmet[d] -= 1
+                        if unmet[d] == 0:
+                            ready.append(d)
+        if skipped:
+            click.secho('%s skeleton commands skipped because what they depend on failed' % len(skipped), fg='red')
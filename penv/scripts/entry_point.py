@@ -3,29 +3,69 @@
 import click
 import logbook
 import sys
+import importlib
+
+from ..profiling import profiler
 
 _logger = logbook.Logger(__name__)
 logbook.set_datetime_format('local')
 
-@click.group()
+# name -> ('module:attribute', short help) of the commands imported only when used,
+# `p --help` or `p tmux ...` never load python-ldap, pyyaml or requests
+LAZY_COMMANDS = {
+    'dhcpldap': ('penv.ldap:dhcpldap', 'extract / search / check the DHCP data of the labs in LDAP'),
+    'dhcpawn': ('penv.dhcpawn:dhcpawn', 'populate DHCPawn from the files ldap_to_yml wrote'),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    click group importing the module of a lazy command on first lookup
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(super(LazyGroup, self).list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            module, attr = self.lazy_commands[name][0].split(':')
+            self.add_command(getattr(importlib.import_module(module), attr), name)
+        return super(LazyGroup, self).get_command(ctx, name)
+
+    def format_commands(self, ctx, formatter):
+        # the help of commands not loaded yet comes from the registry
+        rows = []
+        for name in self.list_commands(ctx):
+            cmd = self.commands.get(name)
+            if cmd is None:
+                rows.append((name, self.lazy_commands[name][1]))
+            elif not cmd.hidden:
+                rows.append((name, cmd.get_short_help_str(formatter.width - 6 - len(name))))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands=LAZY_COMMANDS)
+@click.option('--profile', is_flag=True, default=False, help='record time, cpu, records, bytes and memory of every stage')
+@click.option('--profile-out', default='penv-profile.json', help='JSON file the stage metrics are written to')
+@click.option('--cprofile', 'cprofile_stage', default=None,
+              help='also run cProfile on this stage (connect, pull_dhcp_data, process_raw, ...)')
+@click.option('--cprofile-out', default=None, help='file of the cProfile stats (default <stage>.prof)')
 @click.pass_context
-def cli(ctx):
-    pass
+def cli(ctx, profile, profile_out, cprofile_stage, cprofile_out):
+    if profile or cprofile_stage:
+        profiler.enable(cprofile_stage)
+        ctx.call_on_close(lambda: profiler.report(profile_out, cprofile_out))
 
 @cli.group()
 def tmux():
     pass
 
-@cli.group()
-def dhcpawn():
-    pass
-
-from ..ldap import dhcpldap as ldap_group
-cli.add_command(ldap_group)
-
-from ..ldap import dhcpawn as dhcpawn_group
-cli.add_command(dhcpawn_group)
-
 def main_entry_point():
     _log_handler = logbook.StderrHandler()
     with _log_handler.applicationbound():
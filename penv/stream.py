@@ -0,0 +1,87 @@
+"""
+export straight from LDAP to DHCPawn (ldap_to_yml --push).
+process_raw hands every host to a HostPusher while it parses the pages
+LDAP sends. a bounded queue takes them to a consumer thread that posts the
+skeleton first (SkeletonScheduler) and then coalesces the hosts into
+/rest/multiple/ requests (HostCoalescer), so pulling, parsing and posting
+overlap. what is held at any time is bounded by the queue, the batch being
+filled and the requests in flight, whatever the size of the lab.
+"""
+import queue
+import threading
+
+from .schedule import SkeletonScheduler
+
+
+class HostPusher(object):
+    """
+    HostWriter like object (see writer.py) posting the hosts instead of
+    writing them.
+    skeleton - skeleton commands posted before any host
+    source - name the hosts are reported under (the lab)
+    """
+
+    def __init__(self, populator, coalescer, deploy=False, skeleton=None, source='ldap', queue_size=1000):
+        self.populator = populator
+        self.coalescer = coalescer
+        self.deploy = deploy
+        self.skeleton = skeleton or []
+        self.source = source
+        self.count = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = None
+
+    def _post_skeleton(self):
+        scheduler = SkeletonScheduler(self.populator)
+        for i, command in enumerate(self.skeleton):
+            scheduler.add(command, 'skeleton', i)
+        scheduler.run()
+
+    def _run(self):
+        # hosts wait in the queue until the skeleton they need is in place
+        try:
+            self._post_skeleton()
+        except Exception as e:
+            self._error = e
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error:
+                # keep draining, the producer must never block on a dead consumer
+                continue
+            key, record = item
+            try:
+                self.coalescer.add(self.source, key, record, str(self.deploy))
+            except Exception as e:
+                self._error = e
+        if not self._error:
+            try:
+                self.coalescer.flush_all()
+            except Exception as e:
+                self._error = e
+
+    def begin(self):
+        self._thread = threading.Thread(target=self._run, name='host-pusher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def host(self, hostname, mac, group, ip=None, subnet=None):
+        rec = {'hostname': hostname, 'mac': mac, 'group': group}
+        if subnet:
+            rec['subnet'] = subnet
+        if ip:
+            rec['ip'] = ip
+        rec['deployed'] = self.deploy
+        self._queue.put(('h%s' % self.count, rec))
+        self.count += 1
+
+    def end(self):
+        """
+        wait until every host was handed to the populator
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
@@ -0,0 +1,66 @@
+import os
+import gzip
+import pickle
+
+SYNC_VERSION = 1
+
+
+class SyncState(object):
+    """
+    what the last incremental export of a lab saw:
+    hwm - high-water mark, the newest modifyTimestamp pulled so far
+    entries - the merged raw (dn -> attrs) snapshot of the lab
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.hwm = None
+        self.entries = dict()
+
+    def load(self):
+        """
+        load the state from disk, return False if there is none
+        """
+        if not os.path.exists(self.fname):
+            return False
+        with gzip.open(self.fname, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != SYNC_VERSION:
+            return False
+        self.hwm = state['hwm']
+        self.entries = state['entries']
+        return True
+
+    def save(self):
+        tmpname = self.fname + '.tmp'
+        with gzip.open(tmpname, 'wb', compresslevel=1) as f:
+            pickle.dump({'version': SYNC_VERSION, 'hwm': self.hwm, 'entries': self.entries},
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, self.fname)
+
+    def merge(self, changed, present=None):
+        """
+        merge changed entries into the snapshot and move the high-water mark.
+        present - set of all dns currently in LDAP, entries missing from it
+        are dropped from the snapshot.
+        return (the entries that really changed, the deleted entries), as
+        lists of (dn, attrs). the pull is by modifyTimestamp >= hwm, so the
+        entries of the hwm second come again and are left out when the
+        snapshot already has them as they are.
+        """
+        really = []
+        for dn, attrs in changed:
+            if self.entries.get(dn) == attrs:
+                continue
+            really.append((dn, attrs))
+            self.entries[dn] = attrs
+            for ts in attrs.get('modifyTimestamp', []):
+                ts = ts.decode('utf-8')
+                if self.hwm is None or ts > self.hwm:
+                    self.hwm = ts
+
+        deleted = []
+        if present is not None:
+            for dn in [dn for dn in self.entries if dn not in present]:
+                deleted.append((dn, self.entries.pop(dn)))
+        return really, deleted
@@ -0,0 +1,245 @@
+"""
+streaming writers of DHCPawn command files.
+records are written as they come in, straight to a file handle
+(anything with a write method) or to a callable taking a string,
+so exports don't hold their output in memory.
+"""
+import os
+import json
+import queue
+import threading
+from .formats import yaml_dump, jsonl_dump, EXTENSIONS, MULTIPLE_URL
+
+
+def _writer(out):
+    return out.write if hasattr(out, 'write') else out
+
+
+def ymlcomment(text):
+    return "#"*10 + "\n# %s\n" % text + "#"*10 + "\n"
+
+
+class HostWriter(object):
+    """
+    writes the /rest/multiple/ command holding all hosts,
+    one host record per line.
+    """
+
+    def __init__(self, out, deploy=False, first_key=0):
+        self.write = _writer(out)
+        self.deploy = deploy
+        # records are keyed h<first_key>, h<first_key+1>, ...
+        self.first_key = first_key
+        self.count = 0
+
+    def begin(self):
+        if not self.deploy:
+            # dont deploy to LDAP
+            self.write("- url: /rest/multiple/\n"+" "*2 +"data: " + \
+                       " " +"{\n" + " "*8 + "\"deploy\": \"False\",\n" + " "*8 + " "*8)
+        else:
+            # deploy to LDAP
+            self.write("- url: /rest/multiple/\n"+" "*2 +"data: " + " " +"{\n" + "\"deploy\": \"True\",\n" + " "*8)
+
+    def host(self, hostname, mac, group, ip=None, subnet=None):
+        if subnet:
+            rec = "h%s: {hostname: \"%s\", mac: \"%s\", group: \"%s\", subnet: \"%s\", ip: \"%s\", deployed: %s },\n" \
+                  % (self.first_key + self.count, hostname, mac, group, subnet, ip, self.deploy)
+        elif ip:
+            rec = "h%s: {hostname: \"%s\", mac: \"%s\", group: \"%s\", ip: \"%s\", deployed: %s },\n" \
+                  % (self.first_key + self.count, hostname, mac, group, ip, self.deploy)
+        else:
+            rec = "h%s: {hostname: \"%s\", mac: \"%s\", group: \"%s\", deployed: %s },\n" \
+                  % (self.first_key + self.count, hostname, mac, group, self.deploy)
+        if self.count:
+            rec = " "*9 + rec
+        self.write(rec)
+        self.count += 1
+
+    def end(self):
+        if self.count:
+            self.write(" "*9)
+        self.write("\n" + " "*8 + "}")
+
+
+def remove_shards(odir, name='ymlcmd'):
+    """
+    remove shard files left from a previous (maybe bigger) export
+    """
+    for f in os.listdir(odir):
+        if f.startswith(name) and f.endswith(tuple(EXTENSIONS.values())):
+            os.remove(os.path.join(odir, f))
+
+
+class ShardWriter(object):
+    """
+    writes host records straight into shard files (<name>0.yml, <name>1.yml, ...
+    or .jsonl),
+    each one a /rest/multiple/ command of at most `records` hosts and
+    roughly at most `max_bytes` bytes (0 = no limit).
+    shards are rendered in memory and written to disk by a background
+    thread while extraction goes on. at the end a manifest listing the
+    shards and their record counts is written next to them, as JSON
+    (which yaml readers take too) so jsonl exports never need pyyaml.
+    has the same interface as HostWriter.
+    """
+
+    def __init__(self, odir, deploy=False, records=500, max_bytes=0, name='ymlcmd', manifest='manifest.yml', fmt='yaml'):
+        self.odir = odir
+        self.fmt = fmt
+        self.deploy = deploy
+        self.records = records
+        self.max_bytes = max_bytes
+        self.name = name
+        self.manifest = manifest
+        self.count = 0
+        self.shards = []
+        self._shard = None
+        self._size = 0
+        # at most a couple of rendered shards wait for the disk
+        self._queue = queue.Queue(maxsize=2)
+        self._error = None
+        self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error:
+                continue
+            path, pieces = item
+            try:
+                with open(path, 'w') as f:
+                    f.writelines(pieces)
+            except Exception as e:
+                self._error = e
+
+    def _append(self, text):
+        self._pieces.append(text)
+        # max_bytes is about the file, non-ascii hostnames and comments take more than a byte
+        self._size += len(text.encode('utf-8'))
+
+    def _open_shard(self):
+        self._pieces = []
+        self._size = 0
+        self._shard = HOST_WRITERS[self.fmt](self._append, self.deploy, first_key=self.count)
+        self._shard.begin()
+
+    def _close_shard(self):
+        self._shard.end()
+        fname = "%s%s%s" % (self.name, len(self.shards), EXTENSIONS[self.fmt])
+        self.shards.append({'file': fname, 'records': self._shard.count})
+        self._queue.put((os.path.join(self.odir, fname), self._pieces))
+        self._shard = None
+        self._pieces = None
+
+    def begin(self):
+        remove_shards(self.odir, self.name)
+        self._thread = threading.Thread(target=self._run, name='shard-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def host(self, hostname, mac, group, ip=None, subnet=None):
+        if self._shard is None:
+            self._open_shard()
+        self._shard.host(hostname, mac, group, ip, subnet)
+        self.count += 1
+        if self._shard.count >= self.records or (self.max_bytes and self._size >= self.max_bytes):
+            self._close_shard()
+
+    def end(self):
+        if self._shard is not None:
+            self._close_shard()
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+        with open(os.path.join(self.odir, self.manifest), 'w') as f:
+            json.dump({'shards': self.shards, 'records': self.count,
+                       'deploy': self.deploy, 'format': self.fmt}, f, indent=2)
+            f.write('\n')
+
+
+class JsonlHostWriter(object):
+    """
+    JSON Lines flavour of HostWriter, every host is its own
+    /rest/multiple/ command on its own line.
+    """
+
+    def __init__(self, out, deploy=False, first_key=0):
+        self.write = _writer(out)
+        self.deploy = deploy
+        self.first_key = first_key
+        self.count = 0
+
+    def begin(self):
+        pass
+
+    def host(self, hostname, mac, group, ip=None, subnet=None):
+        rec = {'hostname': hostname, 'mac': mac, 'group': group}
+        if subnet:
+            rec['subnet'] = subnet
+        if ip:
+            rec['ip'] = ip
+        rec['deployed'] = self.deploy
+        self.write(jsonl_dump({'url': MULTIPLE_URL,
+                               'data': {'deploy': str(self.deploy), 'h%s' % (self.first_key + self.count): rec}}))
+        self.count += 1
+
+    def end(self):
+        pass
+
+
+class TeeWriter(object):
+    """
+    hands every host to several HostWriter like objects,
+    count is the one of the first of them
+    """
+
+    def __init__(self, writers):
+        self.writers = writers
+
+    @property
+    def count(self):
+        return self.writers[0].count
+
+    def begin(self):
+        for w in self.writers:
+            w.begin()
+
+    def host(self, hostname, mac, group, ip=None, subnet=None):
+        for w in self.writers:
+            w.host(hostname, mac, group, ip, subnet)
+
+    def end(self):
+        for w in self.writers:
+            w.end()
+
+
+HOST_WRITERS = {'yaml': HostWriter, 'jsonl': JsonlHostWriter}
+
+
+SKELETON_SECTIONS = ('subnets', 'pools', 'dhcpranges', 'calcranges', 'groups')
+
+
+def write_skeleton(out, sections, fmt='yaml'):
+    """
+    sections - dict of section name -> list of commands ({'url':..., 'data':...})
+    """
+    write = _writer(out)
+    if fmt == 'jsonl':
+        for name in SKELETON_SECTIONS:
+            for cmd in sections.get(name, []):
+                write(jsonl_dump(cmd))
+        return
+    write("---\n")
+    for name in SKELETON_SECTIONS:
+        write(ymlcomment(name))
+        if not sections.get(name):
+            continue
+        if hasattr(out, 'write'):
+            yaml_dump(sections[name], out)
+        else:
+            write(yaml_dump(sections[name]))
+    write("...")